@@ -9,12 +9,27 @@ except ImportError:
     from urllib import urlencode
     from urllib2 import urlopen, Request, HTTPError
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import datetime
+import json
 import os
+import re
+import stat
+import threading
+from builtins import str
 from contextlib import closing
 from io import open
 
+import gridcache
+import httpclient
+import pgzfile
+import raspbundle
 import raspdata
+import rucsoundings
 
 ## Abstract Classes
 
@@ -26,38 +41,247 @@ class RASPDataTimeSlice:
         raise NotImplementedError()
     def data(self, parameter):
         raise NotImplementedError()
+    # The window with lower-left corner (x0, y0) and the given size
+    def dataRegion(self, parameter, x0, y0, width, height):
+        image, _ = self.data(parameter)
+        region = image.region(x0, y0, width, height)
+        return region, region.dims()
+
+# Call function(*request) for each of 'requests' with up to maxWorkers
+# threads. Exceptions are swallowed, so this only suits warming caches.
+def _runConcurrently(function, requests, maxWorkers):
+    pending = queue.Queue()
+    for request in requests:
+        pending.put(request)
+    def worker():
+        while True:
+            try:
+                request = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                function(*request)
+            except Exception:
+                pass
+    threads = [threading.Thread(target=worker) for i in range(min(maxWorkers, pending.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
 ## RASP
 
+# Set WEATHERBOT_CHECK_PARAMETERS to make the data sources raise when a
+# classifier reads a parameter missing from its requiredParameters(). Returns
+# the parameters to pass as 'declaredParameters', or None when not checking.
+def declaredParameters(classifier):
+    if os.environ.get('WEATHERBOT_CHECK_PARAMETERS'):
+        return set(classifier.requiredParameters())
+    return None
+
+def checkDeclared(declared, parameter):
+    if declared is not None and parameter not in declared:
+        raise ValueError('Parameter {0} was read but not declared by requiredParameters()'.format(parameter))
+
+# Parsed grids are kept in 'memoryCache', a gridcache.GridMemoryCache keyed
+# by URL, which may be shared with other sources. Each source gets its own
+# if none is given. Responses are revalidated against 'httpCache', an
+# httpcache.HTTPGridCache, if given. Reading a parameter not in
+# 'declaredParameters' raises, unless it is None.
 class WebRASPDataSource:
-    def __init__(self, baseURL):
+    def __init__(self, baseURL, httpCache=None, declaredParameters=None, memoryCache=None):
         self.__baseURL = baseURL
-        self.__parsedData = {}
+        self.__httpCache = httpCache
+        self.__declaredParameters = declaredParameters
+        self.__memoryCache = memoryCache if memoryCache is not None else gridcache.GridMemoryCache()
+    def __url(self, parameter, dayOffset, time):
+        return '{0}/OUT+{1}/FCST/{2}.curr.{3}lst.d2.data'.format(
+            self.__baseURL,
+            dayOffset,
+            parameter,
+            time
+        )
     def data(self, parameter, dayOffset, time):
-        dataString = '{0}-{1}-{2}'.format(parameter, dayOffset, time)
-        if dataString in self.__parsedData:
-            return self.__parsedData[dataString]
-        else:
-            url = '{0}/OUT+{1}/FCST/{2}.curr.{3}lst.d2.data'.format(
-                self.__baseURL,
-                dayOffset,
-                parameter,
-                time
-            )
-            with closing(urlopen(url)) as file:
-                self.__parsedData[dataString] = raspdata.parseData(file)
-            return self.__parsedData[dataString]
+        checkDeclared(self.__declaredParameters, parameter)
+        url = self.__url(parameter, dayOffset, time)
+        def fetch():
+            if self.__httpCache:
+                return self.__httpCache.data(url)
+            with closing(httpclient.urlopen(url)) as file:
+                return raspdata.parseData(file)
+        return self.__memoryCache.data(url, fetch)
+    # Download and parse all of 'requests', a list of (parameter, dayOffset,
+    # time), with up to maxWorkers threads so that the data() calls after are
+    # served from memory, as far as the memory cache holds them. Failures are
+    # left for data() to raise later.
+    def prefetch(self, requests, maxWorkers=8):
+        requests = [request for request in set(requests) if self.__url(*request) not in self.__memoryCache]
+        _runConcurrently(self.data, requests, maxWorkers)
 
+# 'directory' is an archived day written by download-rasp.py, which may have
+# been converted to bundles by raspbundle.py, or the path of a bundle file.
+# Decoded grids are kept in 'gridCache', a gridcache.GridFileCache, if given,
+# and in 'memoryCache', a gridcache.GridMemoryCache keyed by file path and
+# mtime. Each source gets its own memory cache if none is given. Files are
+# stat'ed once per source and again by preload(), so a file changed after
+# that is read again by the next preload() or a new source.
+# 'declaredParameters' is as for WebRASPDataSource.
 class ArchivedRASPDataSource:
-    def __init__(self, directory):
+    def __init__(self, directory, gridCache=None, declaredParameters=None, memoryCache=None):
         self.__directory = directory
-    def data(self, parameter, time):
+        # A bundle file may be given instead of a directory
+        self.__bundleFile = directory if os.path.isfile(directory) else None
+        self.__gridCache = gridCache
+        self.__declaredParameters = declaredParameters
+        self.__memoryCache = memoryCache if memoryCache is not None else gridcache.GridMemoryCache()
+        self.__bundles = {}
+        self.__deltaFilenames = {}
+        self.__deltaLocks = {}
+        self.__stats = {}
+        self.__lock = threading.Lock()
+    # The open bundle that holds data for 'time', or None
+    def __bundle(self, time):
+        if self.__bundleFile:
+            candidates = [self.__bundleFile]
+        else:
+            candidates = [
+                os.path.join(self.__directory, raspbundle.BUNDLE_NAME),
+                os.path.join(self.__directory, raspbundle.bundleNameForTime(time))
+            ]
+        with self.__lock:
+            for filename in candidates:
+                if filename not in self.__bundles:
+                    self.__bundles[filename] = raspbundle.RASPBundle(filename) if os.path.isfile(filename) else None
+                if self.__bundles[filename] is not None:
+                    return self.__bundles[filename]
+        return None
+    # Close the bundles opened so far. Grids already read stay valid.
+    def close(self):
+        with self.__lock:
+            bundles = [bundle for bundle in self.__bundles.values() if bundle is not None]
+            self.__bundles = {}
+        for bundle in bundles:
+            bundle.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    # The path, mtime and size of a regular file, or None if there is none.
+    # Kept until the next preload(), so memory cache hits do not touch the
+    # disk.
+    def __stat(self, filename):
+        with self.__lock:
+            if filename in self.__stats:
+                return self.__stats[filename]
+        try:
+            info = os.stat(filename)
+            result = (os.path.abspath(filename), info.st_mtime, info.st_size) if stat.S_ISREG(info.st_mode) else None
+        except OSError:
+            result = None
+        with self.__lock:
+            return self.__stats.setdefault(filename, result)
+    # Key of a grid in the memory cache. The mtime and size make an edited
+    # file miss.
+    def __memoryKey(self, filename, key):
+        return self.__stat(filename) + (key,)
+    # The hourly file of 'parameter' at 'time', or None if there is none
+    def __filename(self, parameter, time):
         filename = '{0}/{1}.curr.{2}lst.d2.data'.format(self.__directory, parameter, time)
-        if not os.path.isfile(filename):
+        if self.__stat(filename) is None:
             filename = '{0}/{1}.curr.{2}lst.d2.data.pgz'.format(self.__directory, parameter, time)
-        if not os.path.isfile(filename):
-            raise IOError('File not found for data {0} at time {1}'.format(parameter, time))
-        return raspdata.parseData(open(filename, 'rb'))
+        if self.__stat(filename) is None:
+            return None
+        return filename
+    # The day of delta-encoded data of 'parameter' and the lock to decode it
+    # under, or (None, None) if there is none. Looked for once.
+    def __deltaFilename(self, parameter):
+        with self.__lock:
+            if parameter not in self.__deltaFilenames:
+                filename = '{0}/{1}.curr.d2.data.pgzd'.format(self.__directory, parameter)
+                self.__deltaFilenames[parameter] = filename if os.path.isfile(filename) else None
+                self.__deltaLocks[parameter] = threading.Lock()
+            return self.__deltaFilenames[parameter], self.__deltaLocks[parameter]
+    # The image from a day of delta-encoded data, or None if there is none.
+    # The whole day is decoded on first access and every hour of it goes
+    # into the memory cache, since the other times of the day are usually
+    # asked for next. A lock per file keeps threads from decoding a day
+    # twice without holding up the other parameters.
+    def __deltaData(self, parameter, time):
+        filename, lock = self.__deltaFilename(parameter)
+        if filename is None:
+            return None
+        def decodeDay():
+            with open(filename, 'rb') as file:
+                images = pgzfile.readPgzDeltaImages(file)
+            if time not in images:
+                raise IOError('File not found for data {0} at time {1}'.format(parameter, time))
+            for (otherTime, image) in images.items():
+                if otherTime != time:
+                    self.__memoryCache.data(self.__memoryKey(filename, otherTime), lambda image=image: image)
+            return images[time]
+        with lock:
+            return self.__memoryCache.data(self.__memoryKey(filename, time), decodeDay)
+    # The file that data() reads 'parameter' at 'time' from, or None if there
+    # is none
+    def sourceFilename(self, parameter, time):
+        bundle = self.__bundle(time)
+        if bundle and (parameter, time) in bundle:
+            return bundle.filename()
+        filename = self.__filename(parameter, time)
+        if filename is None:
+            filename, _ = self.__deltaFilename(parameter)
+        return filename
+    def data(self, parameter, time):
+        checkDeclared(self.__declaredParameters, parameter)
+        bundle = self.__bundle(time)
+        if bundle and (parameter, time) in bundle:
+            def decode():
+                if self.__gridCache:
+                    return self.__gridCache.data(bundle.filename(), (parameter, time), lambda: bundle.data(parameter, time))
+                return bundle.data(parameter, time)
+            return self.__memoryCache.data(self.__memoryKey(bundle.filename(), (parameter, time)), decode)
+        filename = self.__filename(parameter, time)
+        if filename is None:
+            # A day of delta-encoded data only when there are no hourly files
+            deltaData = self.__deltaData(parameter, time)
+            if deltaData is None:
+                raise IOError('File not found for data {0} at time {1}'.format(parameter, time))
+            return deltaData
+        def parse():
+            with open(filename, 'rb') as file:
+                return raspdata.parseData(file)
+        def decode():
+            if self.__gridCache:
+                return self.__gridCache.data(filename, None, parse)
+            return parse()
+        return self.__memoryCache.data(self.__memoryKey(filename, None), decode)
+    # Decode the files for all combinations of 'parameters' and 'times' with
+    # up to maxWorkers threads, so that the data() calls after are served
+    # from memory. zlib releases the GIL, so this helps even in CPython.
+    # Failures are left for data() to raise later. Files are stat'ed again,
+    # so ones changed since the last call are read again.
+    def preload(self, parameters, times, maxWorkers=8):
+        with self.__lock:
+            self.__stats = {}
+        _runConcurrently(self.data, [(parameter, time) for parameter in set(parameters) for time in set(times)], maxWorkers)
+    # Only the needed tiles are decompressed from tiled PGZ files, unless the
+    # whole grid is in memory already
+    def dataRegion(self, parameter, time, x0, y0, width, height):
+        checkDeclared(self.__declaredParameters, parameter)
+        bundle = self.__bundle(time)
+        filename = None
+        if not (bundle and (parameter, time) in bundle):
+            filename = self.__filename(parameter, time)
+        if filename is None or self.__memoryKey(filename, None) in self.__memoryCache:
+            image, _ = self.data(parameter, time)
+            region = image.region(x0, y0, width, height)
+            return region, region.dims()
+        with open(filename, 'rb') as file:
+            if filename.endswith('.pgz'):
+                return pgzfile.readPgzRegion(file, x0, y0, width, height)
+            image, _ = raspdata.parseData(file)
+        region = image.region(x0, y0, width, height)
+        return region, region.dims()
 
 class WebRASPDataTimeSlice(RASPDataTimeSlice):
     def __init__(self, webDataSource, dayOffset, time):
@@ -78,6 +302,8 @@ class ArchivedRASPDataTimeSlice(RASPDataTimeSlice):
         self.__time = time
     def data(self, parameter):
         return self.__archivedDataSource.data(parameter, self.__time)
+    def dataRegion(self, parameter, x0, y0, width, height):
+        return self.__archivedDataSource.dataRegion(parameter, self.__time, x0, y0, width, height)
     def time(self):
         return self.__time
     def date(self):
@@ -85,9 +311,73 @@ class ArchivedRASPDataTimeSlice(RASPDataTimeSlice):
 
 ## Soundings
 
+# Soundings for one location, fetched a time range per request. Times are
+# naive UTC datetimes, rounded down to the hour. Parsed soundings are kept
+# in memory, and as JSON files in 'cacheDirectory' if given. A cached
+# sounding for a time that was still in the future when it was fetched is
+# refetched after maxAge seconds, since newer model runs will have changed
+# it.
 class WebSoundingDataSource:
-    def __init__(self, location):
+    def __init__(self, location, model='GFS', cacheDirectory=None, maxAge=3600, baseURL=rucsoundings.SOUNDINGS_URL):
         self.__location = location
-    def openRequest(self, dataRequest, dateTime):
-        model = 'GFS'
-        return urlopen(rucsoundings.urlForSounding(self.__location, model, dateTime))
+        self.__model = model
+        self.__cacheDirectory = cacheDirectory
+        self.__maxAge = maxAge
+        self.__baseURL = baseURL
+        self.__soundings = {}
+        if cacheDirectory and not os.path.isdir(cacheDirectory):
+            os.makedirs(cacheDirectory)
+    def __cacheFilename(self, validTime):
+        name = '{0}-{1}-{2}.json'.format(self.__location, self.__model, validTime.strftime('%Y%m%d%H'))
+        return os.path.join(self.__cacheDirectory, re.sub(r'[^\w.-]', '_', name))
+    def __readCache(self, validTime):
+        if not self.__cacheDirectory:
+            return None
+        try:
+            with open(self.__cacheFilename(validTime), 'r') as file:
+                entry = json.load(file)
+        except (IOError, OSError, ValueError):
+            return None
+        fetched = datetime.datetime.utcfromtimestamp(entry['fetched'])
+        if fetched < validTime and (datetime.datetime.utcnow() - fetched).total_seconds() > self.__maxAge:
+            return None
+        return rucsoundings.Sounding.fromJSON(entry['sounding'])
+    def __writeCache(self, validTime, sounding, fetched):
+        if not self.__cacheDirectory:
+            return
+        with open(self.__cacheFilename(validTime), 'w') as file:
+            file.write(str(json.dumps({'fetched': fetched, 'sounding': sounding.toJSON()})))
+    # Return {valid time: rucsoundings.Sounding} for each hour from
+    # startDateTime to endDateTime inclusive that the server has. Everything
+    # not cached comes from one request.
+    def soundings(self, startDateTime, endDateTime):
+        startDateTime = startDateTime.replace(minute=0, second=0, microsecond=0)
+        hours = []
+        while startDateTime <= endDateTime:
+            hours.append(startDateTime)
+            startDateTime += datetime.timedelta(hours=1)
+
+        missing = []
+        for hour in hours:
+            if hour not in self.__soundings:
+                cached = self.__readCache(hour)
+                if cached:
+                    self.__soundings[hour] = cached
+                else:
+                    missing.append(hour)
+        if missing:
+            url = rucsoundings.urlForSoundings(self.__location, self.__model, missing[0], missing[-1] + datetime.timedelta(hours=1), self.__baseURL)
+            fetched = (datetime.datetime.utcnow() - datetime.datetime.utcfromtimestamp(0)).total_seconds()
+            with closing(httpclient.urlopen(url)) as file:
+                for (validTime, sounding) in rucsoundings.parseSoundings(file):
+                    self.__soundings[validTime] = sounding
+                    self.__writeCache(validTime, sounding, fetched)
+
+        return dict((hour, self.__soundings[hour]) for hour in hours if hour in self.__soundings)
+    # Return the rucsoundings.Sounding for the hour of dateTime
+    def sounding(self, dateTime):
+        dateTime = dateTime.replace(minute=0, second=0, microsecond=0)
+        soundings = self.soundings(dateTime, dateTime)
+        if dateTime not in soundings:
+            raise IOError('No sounding for {0} at {1}'.format(self.__location, dateTime))
+        return soundings[dateTime]
@@ -19,8 +19,10 @@
 
 import argparse
 import json
+import re
 import threading
 from builtins import range
+from contextlib import closing
 from io import open
 
 try:
@@ -32,6 +34,7 @@ except ImportError:
     from urllib import urlencode
     from urllib2 import urlopen, Request, HTTPError
 
+import httpclient
 import pgzfile
 import raspdata
 
@@ -44,25 +47,37 @@ def splitList(fullList, numParts):
         ret.append([fullList[i] for i in range(part * n // numParts, (part+1) * n // numParts)])
     return ret
 
-def downloadRaspFiles(filesToDownload, baseURL, forecastOffset, outputDir):
+# With deltaFrames, a dict, the parsed data files are added to it as
+# deltaFrames[parameter][time] = image instead of being written out
+def downloadRaspFiles(filesToDownload, baseURL, forecastOffset, outputDir, deltaFrames=None, deltaLock=None):
     for raspFile in filesToDownload:
         print('Downloading ' + raspFile + '...')
         url = baseURL + '/OUT+' + str(forecastOffset) + '/FCST/' + raspFile
         try:
-            response = urlopen(url)
+            response = httpclient.urlopen(url)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             print('ERROR: resource not found on server: {0}'.format(raspFile))
             continue
-        isPgz = args.binary and '.data' in raspFile
-        filename = '{0}/{1}{2}'.format(outputDir, raspFile, '.pgz' if isPgz else '')
-        with open(filename, 'wb') as output:
-            if isPgz:
-                (data, dims) = raspdata.parseData(response)
-                pgzfile.writePgzImage(data, dims, output)
-            else:
-                output.write(response.read())
+        with closing(response):
+            saveRaspFile(response, raspFile, outputDir, deltaFrames, deltaLock)
+
+def saveRaspFile(response, raspFile, outputDir, deltaFrames, deltaLock):
+    if deltaFrames is not None and '.data' in raspFile:
+        m = re.search(r'^(\w+)\.curr\.(\d+)lst', raspFile)
+        (data, dims) = raspdata.parseData(response)
+        with deltaLock:
+            deltaFrames.setdefault(m.group(1), {})[int(m.group(2))] = (data, dims)
+        return
+    isPgz = args.binary and '.data' in raspFile
+    filename = '{0}/{1}{2}'.format(outputDir, raspFile, '.pgz' if isPgz else '')
+    with open(filename, 'wb') as output:
+        if isPgz:
+            (data, dims) = raspdata.parseData(response)
+            pgzfile.writePgzImage(data, dims, output)
+        else:
+            output.write(response.read())
 
 if __name__=='__main__':
 
@@ -72,7 +87,9 @@ if __name__=='__main__':
     parser.add_argument('-d', '--day', type=int, default=0, help='Offset in days from today')
     parser.add_argument('-t', '--type', type=str, choices=['all', 'raw', 'images'], default='raw', help='What kind of files to download')
     parser.add_argument('-b', '--binary', action='store_true', help='Write data files in binary format')
+    parser.add_argument('--delta', action='store_true', help='Write all the times of each data file as one delta-encoded binary file')
     parser.add_argument('-c', '--times', nargs='+', type=int, default=[1000, 1100, 1200, 1300, 1400, 1500, 1600, 1700, 1800], metavar='lst', help='What times to download data for')
+    parser.add_argument('--timeout', type=float, default=30.0, metavar='s', help='Timeout in seconds for each request')
     args = parser.parse_args()
 
     dataNames = (
@@ -128,10 +145,21 @@ if __name__=='__main__':
         filesToDownload = imageFiles
 
     NUM_THREADS = 4
+    # Keep one connection open for each thread
+    httpclient.setSharedClient(httpclient.HTTPClient(NUM_THREADS, args.timeout))
     filesToDownloadPerThread = splitList(filesToDownload, NUM_THREADS)
+    deltaFrames = {} if args.delta else None
+    deltaLock = threading.Lock()
     threads = []
     for i in range(NUM_THREADS):
-        threads.append(threading.Thread(None, target=downloadRaspFiles, args=(filesToDownloadPerThread[i], args.url, args.day, args.output_dir)))
+        threads.append(threading.Thread(None, target=downloadRaspFiles, args=(filesToDownloadPerThread[i], args.url, args.day, args.output_dir, deltaFrames, deltaLock)))
         threads[i].start()
     for i in range(NUM_THREADS):
         threads[i].join()
+
+    if args.delta:
+        for parameter in sorted(deltaFrames):
+            frames = deltaFrames[parameter]
+            dims = frames[min(frames)][1]
+            with open('{0}/{1}.curr.d2.data.pgzd'.format(args.output_dir, parameter), 'wb') as output:
+                pgzfile.writePgzDeltaImages(dict((time, data) for (time, (data, _)) in frames.items()), dims, output)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# This file is part of GliderWeatherBot.
+#
+# GliderWeatherBot is copyright Philip G. Lee, 2018.
+#
+# GliderWeatherBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GliderWeatherBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+from builtins import str
+from io import open
+
+import numpy
+
+import raspgrid
+import utilities
+
+# Each cached grid is a file with a fixed-size header line
+#  'RASPGRID 1 <width> <height> <byteorder> <source mtime> <source size>'
+# padded to HEADER_SIZE bytes, followed by the raw int32 [y, x] array in the
+# machine's byte order. That way a cached grid can be memory-mapped as-is.
+HEADER_SIZE = 128
+SUFFIX = '.grid'
+
+# A directory of decoded grids, so that hot archive days skip decompression
+# and parsing. Files are evicted least-recently-used first once the
+# directory holds more than maxBytes, and a cached grid is rebuilt when its
+# source file's mtime or size changes.
+class GridFileCache:
+    def __init__(self, directory, maxBytes=2**30):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__directory = directory
+        self.__size = utilities.DirectorySizeLimit(directory, SUFFIX, maxBytes)
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __cacheFilename(self, sourceFilename, key):
+        name = '{0}:{1}'.format(os.path.abspath(sourceFilename), key)
+        return os.path.join(self.__directory, hashlib.sha1(name.encode('utf-8')).hexdigest() + SUFFIX)
+
+    @staticmethod
+    def __header(dims, sourceStat):
+        header = 'RASPGRID 1 {0} {1} {2} {3!r} {4}'.format(dims[0], dims[1], sys.byteorder, sourceStat.st_mtime, sourceStat.st_size)
+        return str(header.ljust(HEADER_SIZE - 1) + '\n').encode('ascii')
+
+    # The memory-mapped grid, or None if it is missing or stale
+    def __read(self, cacheFilename, sourceStat):
+        try:
+            with open(cacheFilename, 'rb') as file:
+                header = file.read(HEADER_SIZE)
+        except (IOError, OSError):
+            return None
+        m = re.search(r'^RASPGRID 1 (\d+) (\d+) ', header.decode('ascii', 'replace'))
+        if not m:
+            return None
+        dims = (int(m.group(1)), int(m.group(2)))
+        if header != GridFileCache.__header(dims, sourceStat):
+            return None
+        data = numpy.memmap(cacheFilename, dtype=numpy.int32, mode='r', offset=HEADER_SIZE, shape=(dims[1], dims[0]))
+        return raspgrid.RASPGrid(data)
+
+    def __write(self, cacheFilename, image, dims, sourceStat):
+        tempFilename = '{0}.{1}.{2}.tmp'.format(cacheFilename, os.getpid(), threading.current_thread().ident)
+        with open(tempFilename, 'wb') as file:
+            file.write(GridFileCache.__header(dims, sourceStat))
+            file.write(numpy.ascontiguousarray(image.array(), dtype=numpy.int32).tobytes())
+        os.rename(tempFilename, cacheFilename)
+
+    # Return image, (width, height) for the data in sourceFilename. 'key'
+    # tells apart the grids of files that hold more than one, like bundles.
+    # On a miss, loader() is called to decode the grid.
+    def data(self, sourceFilename, key, loader):
+        sourceStat = os.stat(sourceFilename)
+        cacheFilename = self.__cacheFilename(sourceFilename, key)
+        image = self.__read(cacheFilename, sourceStat)
+        if image is not None:
+            # The mtime of a cache file is its last access time
+            os.utime(cacheFilename, None)
+            with self.__lock:
+                self.hits += 1
+            return image, image.dims()
+
+        image, dims = loader()
+        self.__write(cacheFilename, image, dims, sourceStat)
+        with self.__lock:
+            self.misses += 1
+            self.evictions += self.__size.written(cacheFilename)
+        return image, dims
+
+# An in-memory least-recently-used cache of decoded grids. Entries are
+# evicted oldest first once the grids held take more than maxBytes. One cache
+# may be shared between data sources and threads, as long as the keys they
+# use cannot collide.
+class GridMemoryCache:
+    def __init__(self, maxBytes=256 * 2**20):
+        self.__maxBytes = maxBytes
+        self.__entries = collections.OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__entries
+
+    # Bytes of grid data currently held
+    def bytes(self):
+        return self.__bytes
+
+    # Return image, (width, height) for 'key'. On a miss, loader() is called
+    # without the lock held to decode the grid.
+    def data(self, key, loader):
+        with self.__lock:
+            if key in self.__entries:
+                entry = self.__entries.pop(key)
+                self.__entries[key] = entry
+                self.hits += 1
+                return entry
+
+        image, dims = loader()
+        size = image.array().nbytes
+        with self.__lock:
+            self.misses += 1
+            if key in self.__entries:
+                self.__bytes -= self.__entries.pop(key)[0].array().nbytes
+            self.__entries[key] = (image, dims)
+            self.__bytes += size
+            while self.__bytes > self.__maxBytes:
+                _, (evicted, _) = self.__entries.popitem(last=False)
+                self.__bytes -= evicted.array().nbytes
+                self.evictions += 1
+        return image, dims
+
+    def logStats(self):
+        logging.info('Memory cache: {0} hits, {1} misses, {2} evictions, {3} bytes held'.format(self.hits, self.misses, self.evictions, self.__bytes))
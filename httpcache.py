@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# This file is part of GliderWeatherBot.
+#
+# GliderWeatherBot is copyright Philip G. Lee, 2018.
+#
+# GliderWeatherBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GliderWeatherBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
+
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from builtins import str
+from contextlib import closing
+from io import open
+
+import httpclient
+import pgzfile
+import raspdata
+import utilities
+
+SUFFIX = '.cache'
+
+# An on-disk cache of parsed RASP data files keyed by URL. Each entry is a
+# file holding a JSON line with the URL, ETag and Last-Modified of the
+# response, followed by the grid as a PGZ image. Entries are revalidated with
+# a conditional GET, so an unchanged file costs only a round trip of headers.
+# Files are evicted least-recently-used first once the directory holds more
+# than maxBytes.
+class HTTPGridCache:
+    def __init__(self, directory, maxBytes=256 * 2**20):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__directory = directory
+        self.__size = utilities.DirectorySizeLimit(directory, SUFFIX, maxBytes)
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __cacheFilename(self, url):
+        return os.path.join(self.__directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + SUFFIX)
+
+    # The validators of a cached URL, or None
+    def __readValidators(self, cacheFilename, url):
+        try:
+            with open(cacheFilename, 'rb') as file:
+                validators = json.loads(file.readline().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        return validators if validators.get('url') == url else None
+
+    def __readImage(self, cacheFilename):
+        with open(cacheFilename, 'rb') as file:
+            file.readline()
+            return pgzfile.readPgzImage(file)
+
+    def __write(self, cacheFilename, validators, image, dims):
+        tempFilename = '{0}.{1}.{2}.tmp'.format(cacheFilename, os.getpid(), threading.current_thread().ident)
+        with open(tempFilename, 'wb') as file:
+            file.write(str(json.dumps(validators) + '\n').encode('utf-8'))
+            pgzfile.writePgzImage(image, dims, file, level=1)
+        os.rename(tempFilename, cacheFilename)
+
+    # Return image, (width, height) for the RASP data file at 'url'
+    def data(self, url):
+        cacheFilename = self.__cacheFilename(url)
+        validators = self.__readValidators(cacheFilename, url)
+
+        headers = {}
+        if validators and validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators and validators.get('last-modified'):
+            headers['If-Modified-Since'] = validators['last-modified']
+        try:
+            response = httpclient.urlopen(url, headers)
+        except HTTPError as err:
+            if err.code != 304 or not validators:
+                raise
+            err.close()
+            try:
+                image, dims = self.__readImage(cacheFilename)
+            except (IOError, OSError, ValueError):
+                # Evicted since the validators were read, so fetch it again
+                return self.__store(httpclient.urlopen(url), cacheFilename, url)
+            # The mtime of a cache file is its last access time
+            os.utime(cacheFilename, None)
+            with self.__lock:
+                self.hits += 1
+            return image, dims
+        return self.__store(response, cacheFilename, url)
+
+    def __store(self, response, cacheFilename, url):
+        with closing(response):
+            headers = response.info()
+            image, dims = raspdata.parseData(response)
+        validators = {
+            'url':           url,
+            'etag':          headers.get('ETag'),
+            'last-modified': headers.get('Last-Modified')
+        }
+        # Without validators the response could never be revalidated
+        stored = validators['etag'] or validators['last-modified']
+        if stored:
+            self.__write(cacheFilename, validators, image, dims)
+        with self.__lock:
+            self.misses += 1
+            if stored:
+                self.evictions += self.__size.written(cacheFilename)
+        return image, dims
+
+    def logStats(self):
+        logging.info('HTTP cache: {0} hits, {1} misses, {2} evictions'.format(self.hits, self.misses, self.evictions))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+# This file is part of GliderWeatherBot.
+#
+# GliderWeatherBot is copyright Philip G. Lee, 2018.
+#
+# GliderWeatherBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GliderWeatherBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import unquote, urljoin, urlparse
+    from urllib.error import HTTPError
+    from urllib.request import getproxies, proxy_bypass
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urljoin, urlparse
+    from urllib2 import HTTPError
+    from urllib import getproxies, proxy_bypass, unquote
+
+import base64
+import io
+import socket
+import threading
+
+MAX_REDIRECTS = 5
+
+# The Proxy-Authorization header for the user and password of a parsed
+# proxy URL, if it has them
+def _proxyHeaders(parsedProxy):
+    if parsedProxy.username is None:
+        return {}
+    credentials = '{0}:{1}'.format(unquote(parsedProxy.username), unquote(parsedProxy.password or ''))
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')}
+
+# Idle keep-alive connections to one (scheme, host, port). Connections are
+# created on demand, so the pool never blocks, but at most maxSize idle ones
+# are kept for reuse.
+#
+# With a proxy URL, connections go to the proxy instead, like urlopen()
+# does: http requests are sent to it with the absolute URL, and https ones
+# go through a CONNECT tunnel.
+class ConnectionPool:
+    def __init__(self, scheme, host, port, maxSize, timeout, proxy=None):
+        self.__connectionClass = HTTPSConnection if scheme == 'https' else HTTPConnection
+        self.__host = host
+        self.__port = port
+        self.__maxSize = maxSize
+        self.__timeout = timeout
+        self.__proxy = urlparse(proxy) if proxy else None
+        self.__idle = []
+        self.__lock = threading.Lock()
+
+    def __newConnection(self):
+        proxy = self.__proxy
+        if proxy is None:
+            return self.__connectionClass(self.__host, self.__port, timeout=self.__timeout)
+        proxyPort = proxy.port or (443 if proxy.scheme == 'https' else 80)
+        if self.__connectionClass is HTTPConnection:
+            return HTTPConnection(proxy.hostname, proxyPort, timeout=self.__timeout)
+        connection = HTTPSConnection(proxy.hostname, proxyPort, timeout=self.__timeout)
+        connection.set_tunnel(self.__host, self.__port, _proxyHeaders(proxy))
+        return connection
+
+    # The request target and headers for 'path'
+    def __target(self, path, headers):
+        if self.__proxy is None or self.__connectionClass is not HTTPConnection:
+            return path, headers
+        headers = dict(headers)
+        headers.update(_proxyHeaders(self.__proxy))
+        return 'http://{0}:{1}{2}'.format(self.__host, self.__port, path), headers
+
+    def release(self, connection):
+        with self.__lock:
+            if len(self.__idle) < self.__maxSize:
+                self.__idle.append(connection)
+                return
+        connection.close()
+
+    # Send a GET and return (connection, response). A reused connection may
+    # have been closed by the server since, so that is retried once on a
+    # new connection.
+    def request(self, path, headers):
+        path, headers = self.__target(path, headers)
+        with self.__lock:
+            connection = self.__idle.pop() if self.__idle else None
+        if connection is not None:
+            try:
+                connection.request('GET', path, headers=headers)
+                return connection, connection.getresponse()
+            except (HTTPException, socket.error):
+                connection.close()
+        connection = self.__newConnection()
+        try:
+            connection.request('GET', path, headers=headers)
+            return connection, connection.getresponse()
+        except:
+            connection.close()
+            raise
+
+    def close(self):
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = []
+        for connection in idle:
+            connection.close()
+
+# A file-like response, like the one from urlopen(). Closing it hands the
+# connection back to its pool if the body was read to the end.
+class PooledResponse:
+    def __init__(self, pool, connection, response, url):
+        self.__pool = pool
+        self.__connection = connection
+        self.__response = response
+        self.__url = url
+
+    def read(self, *args):
+        return self.__response.read(*args)
+    def readline(self, *args):
+        return self.__response.readline(*args)
+    def info(self):
+        return self.__response.msg
+    def getcode(self):
+        return self.__response.status
+    def geturl(self):
+        return self.__url
+
+    def close(self):
+        if self.__connection is None:
+            return
+        if self.__response.isclosed():
+            self.__pool.release(self.__connection)
+        else:
+            # Reading the rest of an unwanted body could take a while
+            self.__response.close()
+            self.__connection.close()
+        self.__connection = None
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+# Keep-alive HTTP(S) requests with a pool of connections per host.
+# 'proxies' maps a scheme to the URL of its proxy, read from the http_proxy,
+# https_proxy and no_proxy environment variables like urlopen() does if not
+# given.
+class HTTPClient:
+    def __init__(self, poolSize=4, timeout=30.0, proxies=None):
+        self.__poolSize = poolSize
+        self.__timeout = timeout
+        self.__proxies = getproxies() if proxies is None else proxies
+        self.__pools = {}
+        self.__lock = threading.Lock()
+
+    def __pool(self, parsedURL):
+        scheme = parsedURL.scheme
+        port = parsedURL.port or (443 if scheme == 'https' else 80)
+        proxy = self.__proxies.get(scheme)
+        if proxy and proxy_bypass(parsedURL.hostname):
+            proxy = None
+        key = (scheme, parsedURL.hostname, port, proxy)
+        with self.__lock:
+            if key not in self.__pools:
+                self.__pools[key] = ConnectionPool(scheme, parsedURL.hostname, port, self.__poolSize, self.__timeout, proxy)
+            return self.__pools[key]
+
+    # GET the url like urlopen(). Redirects are followed, and any other status
+    # other than 2xx raises HTTPError.
+    def urlopen(self, url, headers=None):
+        headers = dict(headers or {})
+        for redirect in range(MAX_REDIRECTS + 1):
+            parsedURL = urlparse(url)
+            pool = self.__pool(parsedURL)
+            path = (parsedURL.path or '/') + ('?' + parsedURL.query if parsedURL.query else '')
+            connection, response = pool.request(path, headers)
+            if response.status < 300:
+                return PooledResponse(pool, connection, response, url)
+
+            body = response.read()
+            pool.release(connection)
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            raise HTTPError(url, response.status, response.reason, response.msg, io.BytesIO(body))
+        raise HTTPError(url, response.status, 'Too many redirects', response.msg, io.BytesIO(body))
+
+    def close(self):
+        with self.__lock:
+            pools = list(self.__pools.values())
+        for pool in pools:
+            pool.close()
+
+_sharedClient = None
+_sharedClientLock = threading.Lock()
+
+# The client shared by everything that does not make its own
+def sharedClient():
+    global _sharedClient
+    with _sharedClientLock:
+        if _sharedClient is None:
+            _sharedClient = HTTPClient()
+        return _sharedClient
+
+# Replace the shared client, e.g. with one with a bigger pool
+def setSharedClient(client):
+    global _sharedClient
+    with _sharedClientLock:
+        _sharedClient = client
+
+def urlopen(url, headers=None):
+    return sharedClient().urlopen(url, headers)
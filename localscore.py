@@ -28,30 +28,47 @@ from io import open
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
+import numpy
 
+import gridcache
 import raspdata
 import utilities
 
 # NOTE: eyeballed
 KCVH = (15,91)
 
-class KCVHLocalClassifier:
+class AbstractLocalClassifier:
+    # List of every RASP parameter that feature() and imageSummary() read
+    def requiredParameters(self):
+        raise NotImplementedError()
+    def imageSummary(self, raspDataTimeSlice):
+        raise NotImplementedError()
+    def feature(self, raspDataTimeSlice):
+        raise NotImplementedError()
+    def classify(self, raspDataTimeSlice):
+        raise NotImplementedError()
+
+class KCVHLocalClassifier(AbstractLocalClassifier):
     def __init__(self):
         self.weight = [1.46403088, -0.46282701, 0.75155249, -0.84861172]
         self.bias = 0.185605559061
         self.threshold = 0.0
 
+    def requiredParameters(self):
+        return ['hwcrit', 'zsfclcldif', 'zsfclcl', 'sfcsunpct', 'zblcldif']
+
     def imageSummary(self, raspDataTimeSlice):
         ret = '/tmp/{0}.png'.format(utilities.randomString(8))
 
         try:
-            (dataHcrit, dims) = raspDataTimeSlice.data('hwcrit')
+            (dataHcrit, dims) = raspDataTimeSlice.dataRegion('hwcrit', 0, KCVH[1] - 16, KCVH[0] + 16, 32)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             return None
 
-        imageData = [[dataHcrit(x, y) for x in range(0, KCVH[0] + 16)] for y in reversed(range(KCVH[1] - 16, KCVH[1] + 16))]
+        # Flip the image upside down
+        imageData = dataHcrit.array()[::-1]
 
         plt.clf()
         plt.imshow(imageData, cmap=plt.cm.get_cmap('rainbow'), vmin=0, vmax=6000, interpolation='quadric')
@@ -73,39 +90,34 @@ class KCVHLocalClassifier:
         (dataSfcSun, _) = raspDataTimeSlice.data('sfcsunpct')
         (odPot, _) = raspDataTimeSlice.data('zblcldif')
 
-        def roi(x, y):
-            distance_km = gridResolution_km * math.sqrt( (x-KCVH[0])**2 + (y - KCVH[1])**2 )
-            maxDistance_km = 8000.0 / 3281.0 * 30.0
-            return 1.0 if distance_km < maxDistance_km else 0.0
-
-        def distanceFromKCVH_km(x,y):
-            return gridResolution_km * math.sqrt( (x-KCVH[0])**2 + (y - KCVH[1])**2 )
+        # Pixel coordinates as [y, x] arrays
+        y, x = numpy.indices((dims[1], dims[0]))
+        hcrit = dataHcrit.array()
+        cuBaseValues = cuBase.array()
 
-        def glideRatioFromHcrit(x,y):
-            hcrit_km = dataHcrit(x,y) / 3281.0
-            return distanceFromKCVH_km(x,y) / hcrit_km if roi(x,y) > 0.0 else 9999.0
+        distanceFromKCVH_km = gridResolution_km * numpy.sqrt( (x-KCVH[0])**2 + (y - KCVH[1])**2 )
+        maxDistance_km = 8000.0 / 3281.0 * 30.0
+        roi = numpy.where(distanceFromKCVH_km < maxDistance_km, 1.0, 0.0)
 
-        def glideRatioFromCloudbase(x,y):
-            return distanceFromKCVH_km(x,y) / (cuBase(x,y) / 3281.0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            glideRatioFromHcrit = numpy.where(roi > 0.0, distanceFromKCVH_km / (hcrit / 3281.0), 9999.0)
+            glideRatioFromCloudbase = distanceFromKCVH_km / (cuBaseValues / 3281.0)
 
-        def sunnyCuPredicate(x,y):
-            cuLikelihood = 1.0 if cuPot(x,y) > 300 else 0.0
-            sunny = 1.0 if dataSfcSun(x,y) > 40.0 else 0.0
-            return roi(x,y) * sunny * cuLikelihood
-        def sunnyCuGlideRatio(x,y):
-            return sunnyCuPredicate(x,y) * glideRatioFromCloudbase(x,y)
-        def sunnyCuBase(x,y):
-            return sunnyCuPredicate(x,y) * cuBase(x,y)
+        cuLikelihood = numpy.where(cuPot.array() > 300, 1.0, 0.0)
+        sunny = numpy.where(dataSfcSun.array() > 40.0, 1.0, 0.0)
+        sunnyCuPredicate = roi * sunny * cuLikelihood
+        sunnyCuGlideRatio = numpy.where(sunnyCuPredicate > 0.0, glideRatioFromCloudbase, 0.0)
+        sunnyCuBase = sunnyCuPredicate * cuBaseValues
 
-        roiArea = raspdata.area(roi, dims, lambda x: x > 0.0)
-        sunnyCuArea = sum([sunnyCuPredicate(x,y) for x in range(dims[0]) for y in range(dims[1])])
-        totalOd = sum([roi(x,y) * max(0.0, odPot(x,y)) for x in range(dims[0]) for y in range(dims[1])])
+        roiArea = raspdata.gridArea(roi, lambda v: v > 0.0)
+        sunnyCuArea = sunnyCuPredicate.sum().item()
+        totalOd = (roi * numpy.maximum(0.0, odPot.array())).sum().item()
 
-        areaWhereGlideRatioIsSmall = raspdata.area(glideRatioFromHcrit, dims, lambda x: x < 30.0) / roiArea
+        areaWhereGlideRatioIsSmall = raspdata.gridArea(glideRatioFromHcrit, lambda v: v < 30.0) / roiArea
         # NOTE: the bias below is to make the value defined when sunnyCuArea == 0
-        avgSunnyCuGlideRatio = (raspdata.integral(sunnyCuGlideRatio, dims) + 2 * 60.0) / (sunnyCuArea + 2)
+        avgSunnyCuGlideRatio = (raspdata.gridIntegral(sunnyCuGlideRatio) + 2 * 60.0) / (sunnyCuArea + 2)
         # NOTE: the bias on the denominator is to penalize very small areas of sunny cu
-        avgSunnyCuBase = raspdata.integral(sunnyCuBase, dims) / (sunnyCuArea + 5)
+        avgSunnyCuBase = raspdata.gridIntegral(sunnyCuBase) / (sunnyCuArea + 5)
 
         #asdf = [[dataHcrit(x, y) for x in range(dims[0])] for y in range(dims[1])]
         #asdf = [[dataHcrit(x, y) for x in range(0, KCVH[0] + 16)] for y in reversed(range(KCVH[1] - 16, KCVH[1] + 16))]
@@ -152,8 +164,14 @@ if __name__=='__main__':
     parser = argparse.ArgumentParser(description='Learn good local days from a dataset')
     parser.add_argument('-i', '--dataset', type=str, default='data/kcvh-local.json', metavar='path', help='Dataset json file')
     parser.add_argument('-c', '--classifier', type=str, default='KCVH', metavar='name', help='Name of the classifier')
+    parser.add_argument('--grid-cache', type=str, metavar='path', help='Directory in which to cache decoded grids between runs')
+    parser.add_argument('--grid-cache-size', type=int, default=1024, metavar='MB', help='Size limit of the grid cache')
     args = parser.parse_args()
 
+    gridCache = None
+    if args.grid_cache:
+        gridCache = gridcache.GridFileCache(args.grid_cache, args.grid_cache_size * 2**20)
+
     positives = []
     negatives = []
     with open(args.dataset) as file:
@@ -162,7 +180,7 @@ if __name__=='__main__':
         negatives = dataset['negative']
 
     classifier = LocalClassifierFactory.classifier(args.classifier)
-    (features, labels) = raspdata.featuresAndLabelsFromDataset(positives, negatives, classifier)
+    (features, labels) = raspdata.featuresAndLabelsFromDataset(positives, negatives, classifier, gridCache)
 
     (fMin, fMax, fMean, fStd) = raspdata.featureStats(features)
     print('Feature min: {0}'.format(fMin))
@@ -170,13 +188,16 @@ if __name__=='__main__':
     print('Feature mean: {0}'.format(fMean))
     print('Feature std: {0}'.format(fStd))
 
-    raspdata.evaluateDataset(positives, negatives, classifier)
+    raspdata.evaluateDataset(positives, negatives, classifier, gridCache)
     print('Weight: {0}'.format(classifier.weight))
     print('Bias: {0}'.format(classifier.bias))
     print('\n\n')
 
     (classifier.weight, classifier.bias) = raspdata.learn(features, labels)
 
-    raspdata.evaluateDataset(positives, negatives, classifier)
+    raspdata.evaluateDataset(positives, negatives, classifier, gridCache)
     print('Weight: {0}'.format(classifier.weight))
     print('Bias: {0}'.format(classifier.bias))
+
+    if gridCache:
+        print('Grid cache: {0} hits, {1} misses, {2} evictions'.format(gridCache.hits, gridCache.misses, gridCache.evictions))
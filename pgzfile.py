@@ -17,59 +17,319 @@
 # You should have received a copy of the GNU General Public License
 # along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
 
+import numpy
 import re
-import struct
 import zlib
-from builtins import range, str
+from builtins import range, str, zip
 
-# NOTE: this is not technically PGM, since we are using 4 bytes per pixel
-def writePgzImage(data, dims, fileStream):
+import raspgrid
+
+# Pixels are big-endian 32-bit signed integers
+PIXEL_DTYPE = numpy.dtype('>i4')
+
+# Return the [y, x] array for a RASPGrid, array or image(x, y) callable
+def _imageArray(data, dims):
+    if isinstance(data, raspgrid.RASPGrid):
+        data = data.array()
+    elif not isinstance(data, numpy.ndarray):
+        data = numpy.array([[data(x, y) for x in range(dims[0])] for y in range(dims[1])])
+    if data.shape != (dims[1], dims[0]):
+        raise ValueError('Image shape {0} does not match dims {1}'.format(data.shape, dims))
+    if data.dtype.kind not in 'iu':
+        raise ValueError('PGZ images must be integers, not {0}'.format(data.dtype))
+    if data.dtype.itemsize > 4 and data.size > 0:
+        info = numpy.iinfo(numpy.int32)
+        if data.min() < info.min or data.max() > info.max:
+            raise ValueError('PGZ image values must fit in 32 bits')
+    return data
+
+# Decompress a zlib stream of exactly 'size' bytes into one preallocated
+# buffer, chunkSize bytes at a time. With prefixOnly, stop after the first
+# 'size' bytes of a longer stream.
+def _decompressInto(fileStream, size, chunkSize, prefixOnly=False):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    offset = 0
+    decompressor = zlib.decompressobj()
+    def append(out):
+        if offset + len(out) > size:
+            raise ValueError('PGZ data is larger than its dimensions')
+        view[offset:offset + len(out)] = out
+        return offset + len(out)
+    # zlib.Decompress has no 'eof' on Python 2, but anything read past the
+    # end of the stream is left in unused_data
+    def isDone():
+        return len(decompressor.unused_data) > 0 or (prefixOnly and offset == size)
+    while not isDone():
+        chunk = fileStream.read(chunkSize)
+        if not chunk:
+            break
+        while chunk and not isDone():
+            limit = min(chunkSize, size - offset) if prefixOnly else chunkSize
+            offset = append(decompressor.decompress(chunk, limit))
+            chunk = decompressor.unconsumed_tail
+    if not prefixOnly:
+        offset = append(decompressor.flush())
+    if offset != size:
+        raise ValueError('PGZ data is truncated ({0} of {1} bytes)'.format(offset, size))
+    return buffer
+
+# View big-endian pixel bytes as a native int32 [y, x] array without copying
+def _pixelArray(buffer, dims):
+    image = numpy.frombuffer(buffer, dtype=PIXEL_DTYPE).reshape(dims[1], dims[0])
+    if not image.dtype.isnative:
+        image = image.byteswap(inplace=True).view(image.dtype.newbyteorder())
+    return image
+
+# PGZ v1 is the header line 'PGZ <width> <height> <maxVal>' followed by one
+# zlib stream of all the pixels, row by row.
+#
+# PGZ v2 splits the image into tiles which are compressed independently, so
+# that a region can be read without decompressing the whole image. It is the
+# header line 'PGZ2 <width> <height> <maxVal> <tileWidth> <tileHeight>', then
+# nTiles + 1 big-endian uint64 offsets of the tiles relative to the end of
+# the index, then the tiles. Tiles are stored row by row starting from y = 0,
+# and the tiles on the right and top edges are clipped to the image.
+INDEX_DTYPE = numpy.dtype('>u8')
+
+class PgzHeader:
+    def __init__(self, version, dims, maxVal, tileSize=None):
+        self.version = version
+        self.dims = dims
+        self.maxVal = maxVal
+        self.tileSize = tileSize
+
+    # Number of tiles in x and y
+    def tileCounts(self):
+        return tuple((d + t - 1) // t for (d, t) in zip(self.dims, self.tileSize))
+
+    # (x0, y0, width, height) of the tile at tile coordinates (tx, ty)
+    def tileRect(self, tx, ty):
+        x0 = tx * self.tileSize[0]
+        y0 = ty * self.tileSize[1]
+        return x0, y0, min(self.tileSize[0], self.dims[0] - x0), min(self.tileSize[1], self.dims[1] - y0)
+
+def readPgzHeader(fileStream):
+    formatLine = str(fileStream.readline())
+
+    m = re.search(r'PGZ(2?) (\d+) (\d+) (\d+)(?: (\d+) (\d+))?', formatLine)
+    if not m or (m.group(1) == '2') != (m.group(5) is not None):
+        raise ValueError('Not a PGZ image')
+    dims = (int(m.group(2)), int(m.group(3)))
+    maxVal = int(m.group(4))
+    if m.group(1) == '2':
+        return PgzHeader(2, dims, maxVal, (int(m.group(5)), int(m.group(6))))
+    return PgzHeader(1, dims, maxVal)
+
+def _writeTiles(image, dims, fileStream, level, tileSize):
+    header = PgzHeader(2, dims, 2**32 - 1, tileSize)
+    nTiles = header.tileCounts()
+    tiles = []
+    for ty in range(nTiles[1]):
+        for tx in range(nTiles[0]):
+            x0, y0, width, height = header.tileRect(tx, ty)
+            tile = image[y0:y0 + height, x0:x0 + width]
+            tiles.append(zlib.compress(tile.astype(PIXEL_DTYPE).tobytes(), level))
+    offsets = numpy.cumsum([0] + [len(tile) for tile in tiles]).astype(INDEX_DTYPE)
+
+    fileStream.write(str('PGZ2 {0} {1} {2} {3} {4}\n'.format(dims[0], dims[1], header.maxVal, tileSize[0], tileSize[1])).encode('utf-8'))
+    fileStream.write(offsets.tobytes())
+    for tile in tiles:
+        fileStream.write(tile)
+
+# Read the tiles of a v2 image which overlap the region into a new array
+def _readTiles(fileStream, header, x0, y0, width, height):
+    nTiles = header.tileCounts()
+    offsets = numpy.frombuffer(fileStream.read(INDEX_DTYPE.itemsize * (nTiles[0] * nTiles[1] + 1)), dtype=INDEX_DTYPE)
+    ret = numpy.empty((height, width), dtype=numpy.int32)
+
+    # The tiles are visited in file order, so this only ever skips forward
+    position = 0
+    for ty in range(y0 // header.tileSize[1], (y0 + height - 1) // header.tileSize[1] + 1):
+        for tx in range(x0 // header.tileSize[0], (x0 + width - 1) // header.tileSize[0] + 1):
+            i = ty * nTiles[0] + tx
+            begin = int(offsets[i])
+            end = int(offsets[i + 1])
+            if fileStream.seekable():
+                fileStream.seek(begin - position, 1)
+            else:
+                fileStream.read(begin - position)
+            tileData = zlib.decompress(fileStream.read(end - begin))
+            position = end
+
+            tx0, ty0, tileWidth, tileHeight = header.tileRect(tx, ty)
+            tile = numpy.frombuffer(tileData, dtype=PIXEL_DTYPE).reshape(tileHeight, tileWidth)
+            # Overlap of the tile and the region in image coordinates
+            ax = max(x0, tx0)
+            bx = min(x0 + width, tx0 + tileWidth)
+            ay = max(y0, ty0)
+            by = min(y0 + height, ty0 + tileHeight)
+            ret[ay - y0:by - y0, ax - x0:bx - x0] = tile[ay - ty0:by - ty0, ax - tx0:bx - tx0]
+    return ret
+
+# The zlib-compressed pixels of a v1 image, without the header line
+def compressImage(data, dims, level=9):
+    return zlib.compress(_imageArray(data, dims).astype(PIXEL_DTYPE).tobytes(), level)
+
+# Inverse of compressImage(). 'compressed' may be any buffer, like an mmap slice.
+def decompressImage(compressed, dims):
+    buffer = zlib.decompress(compressed)
+    if len(buffer) != PIXEL_DTYPE.itemsize * dims[0] * dims[1]:
+        raise ValueError('PGZ data does not match dims {0}'.format(dims))
+    # Byteswap while copying out of the immutable buffer
+    return raspgrid.RASPGrid(numpy.frombuffer(buffer, dtype=PIXEL_DTYPE).reshape(dims[1], dims[0]).astype(numpy.int32))
+
+# NOTE: this is not technically PGM, since we are using 4 bytes per pixel.
+# Passing a tileSize of (width, height) writes a tiled PGZ v2 image.
+def writePgzImage(data, dims, fileStream, level=9, tileSize=None):
     assert 'b' in fileStream.mode
+    image = _imageArray(data, dims)
+    if tileSize:
+        _writeTiles(image, dims, fileStream, level, tileSize)
+        return
     maxVal = 2**32 - 1
     fileStream.write(str('PGZ {0} {1} {2}\n'.format(dims[0], dims[1], maxVal)).encode('utf-8'))
-    packedData = bytes()
-    for y in range(dims[1]):
-        for x in range(dims[0]):
-            # Big-endian 32-bit signed integers
-            packed = struct.pack('>i', data(x, y))
-            packedData += packed
-    fileStream.write(zlib.compress(packedData, 9))
-
-def readPgzImage(fileStream):
-    formatLine = str(fileStream.readline())
-    rest = zlib.decompress(fileStream.read())
+    fileStream.write(compressImage(image, dims, level))
+
+def readPgzImage(fileStream, chunkSize=2**16):
+    header = readPgzHeader(fileStream)
+    dims = header.dims
+
+    if header.version == 2:
+        return raspgrid.RASPGrid(_readTiles(fileStream, header, 0, 0, dims[0], dims[1])), dims
+    buffer = _decompressInto(fileStream, PIXEL_DTYPE.itemsize * dims[0] * dims[1], chunkSize)
+    return raspgrid.RASPGrid(_pixelArray(buffer, dims)), dims
+
+# Read the region with lower-left corner (x0, y0) and the given size.
+# Only the tiles that are needed are decompressed for a v2 image, but a v1
+# image must be read in full.
+def readPgzRegion(fileStream, x0, y0, width, height):
+    header = readPgzHeader(fileStream)
+    dims = header.dims
+    if width <= 0 or height <= 0 or x0 < 0 or y0 < 0 or x0 + width > dims[0] or y0 + height > dims[1]:
+        raise ValueError('Region ({0}, {1}) + ({2}, {3}) is not inside {4}'.format(x0, y0, width, height, dims))
 
-    m = re.search('PGZ (\d+) (\d+) (\d+)', formatLine)
+    if header.version == 2:
+        return raspgrid.RASPGrid(_readTiles(fileStream, header, x0, y0, width, height)), (width, height)
+    buffer = _decompressInto(fileStream, PIXEL_DTYPE.itemsize * dims[0] * dims[1], 2**16)
+    image = raspgrid.RASPGrid(_pixelArray(buffer, dims))
+    return image.region(x0, y0, width, height), (width, height)
+
+# PGZ delta ('PGZD') holds the hourly frames of one parameter for a whole
+# day, which are strongly correlated, in a single zlib stream. It is the
+# header line 'PGZD <width> <height> <maxVal> <time0>,<time1>,...' followed
+# by the stream of the first frame and then the difference of each frame from
+# the one before. Frames are big-endian int32 like PGZ v1, and the
+# differences wrap around like int32 so that decoding is exact.
+#
+# This trades random access for size: hour N of the day can only be decoded
+# after the N - 1 before it, so it costs about N PGZ v1 reads. Decoding the
+# whole day costs about as much as reading every hour from its own PGZ v1
+# file, which is how ArchivedRASPDataSource reads these. Use PGZ v1 or v2
+# files where single hours are read at random.
+def writePgzDeltaImages(images, dims, fileStream, level=9):
+    assert 'b' in fileStream.mode
+    times = sorted(images.keys())
+    maxVal = 2**32 - 1
+    fileStream.write(str('PGZD {0} {1} {2} {3}\n'.format(dims[0], dims[1], maxVal, ','.join(str(t) for t in times))).encode('utf-8'))
+    compressor = zlib.compressobj(level)
+    last = None
+    for time in times:
+        frame = _imageArray(images[time], dims).astype(numpy.int32)
+        delta = frame if last is None else frame - last
+        fileStream.write(compressor.compress(delta.astype(PIXEL_DTYPE).tobytes()))
+        last = frame
+    fileStream.write(compressor.flush())
+
+def readPgzDeltaHeader(fileStream):
+    formatLine = str(fileStream.readline())
+    m = re.search(r'PGZD (\d+) (\d+) (\d+) ([\d,]+)', formatLine)
+    if not m:
+        raise ValueError('Not a PGZ delta file')
     dims = (int(m.group(1)), int(m.group(2)))
-    maxVal = int(m.group(3))
-
-    data = []
-    for y in range(dims[1]):
-        rowBegin = 4 * dims[0] * y
-        rowEnd = 4 * dims[0] * (y+1)
-        rowStr = rest[rowBegin:rowEnd]
-        dataRow = []
-        for x in range(dims[0]):
-            s = rowStr[(4*x):(4*(x+1))]
-            dataRow.append(struct.unpack('>i', s)[0])
-        data.append(dataRow)
-    def ret(x,y):
-        return data[y][x]
-    return ret, dims
+    times = [int(t) for t in m.group(4).split(',')]
+    return dims, times
 
-if __name__=='__main__':
-    import argparse
+# Return {time: (image, dims)} for the requested times, or for all of them.
+# The stream is only decompressed up to the last frame that is needed, so
+# the cost grows with the latest time asked for.
+def readPgzDeltaImages(fileStream, times=None, chunkSize=2**16):
+    dims, fileTimes = readPgzDeltaHeader(fileStream)
+    if times is None:
+        times = fileTimes
+    for time in times:
+        if time not in fileTimes:
+            raise ValueError('Time {0} not in PGZ delta file'.format(time))
+    nFrames = max(fileTimes.index(time) for time in times) + 1
+
+    frameSize = PIXEL_DTYPE.itemsize * dims[0] * dims[1]
+    buffer = _decompressInto(fileStream, nFrames * frameSize, chunkSize, prefixOnly=nFrames < len(fileTimes))
+    deltas = _pixelArray(buffer, (dims[0], dims[1] * nFrames)).reshape(nFrames, dims[1], dims[0])
+    frames = numpy.cumsum(deltas, axis=0, dtype=numpy.int32)
+    return dict((time, (raspgrid.RASPGrid(frames[fileTimes.index(time)]), dims)) for time in times)
+
+# Whether a .pgz file decodes in full
+def _isCompletePgzFile(filename):
+    try:
+        with open(filename, 'rb') as f:
+            readPgzImage(f)
+        return True
+    except (IOError, ValueError, IndexError, zlib.error):
+        return False
+
+# Compress one RASP .data file into filename + '.pgz' and return the
+# number of bytes read, or 0 if the .pgz was already up to date. The .pgz is
+# written to a temporary file first and renamed, so that it is never partial
+# and the source is only removed once the .pgz is complete. An existing .pgz
+# is only up to date if it is newer and decodes, since one left by a crash of
+# an older version may be truncated.
+def compressDataFile(filename, level=9, tileSize=None, keep=False):
     import os
 
     import raspdata
 
+    outFilename = filename + '.pgz'
+    bytesRead = 0
+    if not os.path.isfile(outFilename) or os.path.getmtime(outFilename) < os.path.getmtime(filename) or not _isCompletePgzFile(outFilename):
+        bytesRead = os.path.getsize(filename)
+        tempFilename = '{0}.{1}.tmp'.format(outFilename, os.getpid())
+        with open(filename, 'rb') as f:
+            data, dims = raspdata.parseData(f)
+        with open(tempFilename, 'wb+') as of:
+            writePgzImage(data, dims, of, level, tileSize)
+        os.rename(tempFilename, outFilename)
+    if not keep:
+        os.remove(filename)
+    return bytesRead
+
+def _compressDataFileStar(args):
+    return compressDataFile(*args)
+
+if __name__=='__main__':
+    import argparse
+    import multiprocessing
+    import time
+
     parser = argparse.ArgumentParser(description='Compress RASP .data files into .pgz files')
     parser.add_argument('files', type=str, nargs='+', help='Files to compress')
+    parser.add_argument('-t', '--tile-size', nargs=2, type=int, metavar='n', help='Write tiled PGZ v2 files with tiles of this width and height')
+    parser.add_argument('-l', '--level', type=int, default=9, choices=range(10), metavar='0-9', help='zlib compression level')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), metavar='n', help='Number of files to compress in parallel')
+    parser.add_argument('-k', '--keep', action='store_true', help='Keep the original files')
     args = parser.parse_args()
 
-    for filename in args.files:
-        with open(filename, 'rb') as f:
-            data, dims = raspdata.parseData(f)
-            with open(filename + '.pgz', 'wb+') as of:
-                writePgzImage(data, dims, of)
-        os.remove(filename)
+    startTime = time.time()
+    jobs = [(filename, args.level, args.tile_size, args.keep) for filename in args.files]
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        bytesRead = pool.map(_compressDataFileStar, jobs, chunksize=max(1, len(jobs) // (4 * args.jobs)))
+        pool.close()
+        pool.join()
+    else:
+        bytesRead = [_compressDataFileStar(job) for job in jobs]
+    elapsed = max(time.time() - startTime, 1e-6)
+
+    nConverted = sum(1 for x in bytesRead if x > 0)
+    megabytes = sum(bytesRead) / 2.0**20
+    print('Compressed {0} files ({1:.1f} MB) in {2:.1f} s: {3:.1f} files/s, {4:.1f} MB/s. Skipped {5} up-to-date files.'.format(
+        nConverted, megabytes, elapsed, nConverted / elapsed, megabytes / elapsed, len(jobs) - nConverted))
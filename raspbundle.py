@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# This file is part of GliderWeatherBot.
+#
+# GliderWeatherBot is copyright Philip G. Lee, 2018.
+#
+# GliderWeatherBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GliderWeatherBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import mmap
+import os
+import re
+from builtins import str
+from io import open
+
+import pgzfile
+import raspdata
+
+# A bundle holds every parameter of an archived day (or of one time of a
+# day) in a single file. It is the header line 'RASPBUNDLE 1 <indexSize>',
+# then a JSON index of indexSize bytes, then the compressed grids. Each grid
+# is stored like the body of a PGZ v1 image, and the index gives its
+# parameter, time, width, height, and offset and size relative to the end of
+# the index.
+BUNDLE_NAME = 'rasp.bundle'
+
+# Name of a bundle holding just one time of a day
+def bundleNameForTime(time):
+    return 'rasp.{0}lst.bundle'.format(time)
+
+# Matches the file names of the directory layout written by download-rasp.py
+DATA_FILE_PATTERN = re.compile(r'^(\w+)\.curr\.(\d+)lst\.d2\.data(\.pgz)?$')
+
+class RASPBundle:
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__file = open(filename, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        formatLine = self.__map.readline().decode('utf-8')
+        m = re.search(r'^RASPBUNDLE 1 (\d+)', formatLine)
+        if not m:
+            self.close()
+            raise ValueError('{0} is not a RASP bundle'.format(filename))
+        indexBegin = len(formatLine)
+        indexEnd = indexBegin + int(m.group(1))
+        index = json.loads(self.__map[indexBegin:indexEnd].decode('utf-8'))
+        self.__dataBegin = indexEnd
+        self.__entries = dict(((entry['parameter'], entry['time']), entry) for entry in index['entries'])
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+    def filename(self):
+        return self.__filename
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+    # List of (parameter, time) in the bundle
+    def keys(self):
+        return list(self.__entries.keys())
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    # Return image, (width, height) like raspdata.parseData(). The grid is
+    # decompressed on every call and not kept here, so callers keep the ones
+    # they reuse. ArchivedRASPDataSource keeps them in its memory cache.
+    def data(self, parameter, time):
+        key = (parameter, time)
+        if key not in self.__entries:
+            raise IOError('Data {0} at time {1} not in bundle'.format(parameter, time))
+        entry = self.__entries[key]
+        begin = self.__dataBegin + entry['offset']
+        dims = (entry['width'], entry['height'])
+        return pgzfile.decompressImage(self.__map[begin:begin + entry['size']], dims), dims
+
+# Write the images in 'data', a dict of (parameter, time) -> (image, dims),
+# to a bundle file
+def writeBundle(data, filename, level=9):
+    entries = []
+    payloads = []
+    offset = 0
+    for (parameter, time) in sorted(data.keys()):
+        image, dims = data[(parameter, time)]
+        payload = pgzfile.compressImage(image, dims, level)
+        entries.append({
+            'parameter': parameter,
+            'time':      time,
+            'width':     dims[0],
+            'height':    dims[1],
+            'offset':    offset,
+            'size':      len(payload)
+        })
+        payloads.append(payload)
+        offset += len(payload)
+    index = str(json.dumps({'entries': entries})).encode('utf-8')
+
+    with open(filename, 'wb') as file:
+        file.write(str('RASPBUNDLE 1 {0}\n'.format(len(index))).encode('utf-8'))
+        file.write(index)
+        for payload in payloads:
+            file.write(payload)
+
+# Return {(parameter, time): filename} for the .data and .pgz files in a
+# directory. A .data file wins over a .pgz file for the same data.
+def dataFilesInDirectory(directory):
+    ret = {}
+    for name in sorted(os.listdir(directory)):
+        m = DATA_FILE_PATTERN.match(name)
+        if not m:
+            continue
+        key = (m.group(1), int(m.group(2)))
+        if key not in ret or not m.group(3):
+            ret[key] = os.path.join(directory, name)
+    return ret
+
+# Convert an archived directory into one bundle for the day, or one bundle
+# per time if perTime is set. Returns the list of bundles written.
+def bundleDirectory(directory, perTime=False, level=9):
+    files = dataFilesInDirectory(directory)
+    groups = {}
+    for (parameter, time) in files:
+        groupName = bundleNameForTime(time) if perTime else BUNDLE_NAME
+        groups.setdefault(groupName, []).append((parameter, time))
+
+    ret = []
+    for groupName in sorted(groups):
+        data = {}
+        for key in groups[groupName]:
+            with open(files[key], 'rb') as file:
+                data[key] = raspdata.parseData(file)
+        filename = os.path.join(directory, groupName)
+        writeBundle(data, filename, level)
+        ret.append(filename)
+    return ret
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert archived RASP directories into bundle files')
+    parser.add_argument('directories', type=str, nargs='+', help='Directories to convert')
+    parser.add_argument('-t', '--per-time', action='store_true', help='Write one bundle per time instead of one per day')
+    parser.add_argument('-r', '--remove', action='store_true', help='Remove the original files after bundling')
+    args = parser.parse_args()
+
+    for directory in args.directories:
+        files = dataFilesInDirectory(directory)
+        for filename in bundleDirectory(directory, args.per_time):
+            print('Wrote {0}'.format(filename))
+        if args.remove:
+            for filename in files.values():
+                os.remove(filename)
@@ -23,14 +23,17 @@ except ImportError:
     # Learning will be disabled
     pass
 
+import io
 import itertools
 import math
+import numpy
 import os
 from builtins import range, str, zip
 from io import open
 
 import datasource
 import pgzfile
+import raspgrid
 
 def rectDomain(dims):
     def listProduct(listOfIterables):
@@ -59,34 +62,121 @@ def integral(image, dims):
     validValues = [at(coord, image) for coord in rectDomain(dims) if isValueValid(at(coord, image))]
     return sum(validValues)
 
-# Parse the data into image, (width, height)
-def parseData(fileStream):
-    data = [];
+# -- Vectorized reductions --
+# These take a RASPGrid or a [y, x] array of values and an optional boolean
+# mask of which values are valid. The mask defaults to the grid's cached
+# mask, or to isValueValid() applied to every value of a plain array.
+def validMask(values):
+    values = numpy.asarray(values)
+    return (values > -999999) & (values < 999999)
+
+def _validValues(values, valid):
+    if isinstance(values, raspgrid.RASPGrid):
+        if valid is None:
+            valid = values.validMask()
+        values = values.array()
+    elif valid is None:
+        valid = validMask(values)
+    return numpy.asarray(values)[numpy.asarray(valid)]
+
+def gridMinMax(values, valid=None):
+    validValues = _validValues(values, valid)
+    return validValues.min().item(), validValues.max().item()
+
+# 'predicate' must work elementwise on an array, e.g. lambda x: x >= 150
+def gridArea(values, predicate, valid=None):
+    validValues = _validValues(values, valid)
+    totalPredicate = numpy.count_nonzero(predicate(validValues))
+    return float(totalPredicate) / validValues.size
+
+def gridIntegral(values, valid=None):
+    return _validValues(values, valid).sum().item()
+
+# Metadata from the header lines of an ASCII RASP .data file. 'fields' maps
+# each 'Key=' in the two parameter lines to its (string) value.
+class RASPHeader:
+    def __init__(self, title, params1, params2):
+        self.title = title
+        self.params1 = params1
+        self.params2 = params2
+        self.fields = {}
+        for line in (params1, params2):
+            self.fields.update(RASPHeader.__parseFields(line))
+
+    @staticmethod
+    def __parseFields(line):
+        ret = {}
+        key = None
+        for token in line.split():
+            if token.endswith('='):
+                key = token[:-1]
+                ret[key] = ''
+            elif key is not None:
+                ret[key] = (ret[key] + ' ' + token).strip()
+        return ret
 
+# Convert whitespace-separated integers to an array in one step. A token
+# that is not an integer raises ValueError.
+def _parseNumbers(text):
+    return numpy.array(text.split(), dtype=numpy.int32)
+
+# Read the rows of a .data file in chunks of chunkSize bytes, so that a
+# network response does not have to be read line by line
+def _parseBody(fileStream, chunkSize):
+    firstRow = fileStream.readline()
+    width = len(firstRow.split())
+    if width == 0:
+        raise ValueError('RASP data has no rows')
+    parts = [_parseNumbers(firstRow)]
+    remainder = bytes()
+    while True:
+        chunk = fileStream.read(chunkSize)
+        if not chunk:
+            break
+        chunk = remainder + chunk
+        # Only parse up to the last complete row
+        end = chunk.rfind(b'\n') + 1
+        parts.append(_parseNumbers(chunk[:end]))
+        remainder = chunk[end:]
+    parts.append(_parseNumbers(remainder))
+
+    values = numpy.concatenate(parts)
+    if values.size % width != 0:
+        raise ValueError('RASP data has {0} values, which is not a multiple of the row width {1}'.format(values.size, width))
+    return values.reshape(-1, width)
+
+# Parse the data into image, (width, height), header.
+# The header is None for PGZ images.
+def parseDataWithHeader(fileStream, chunkSize=2**16):
     # First line is garbage (unless this is a PGZ image)
     firstLine = str(fileStream.readline())
     if 'PGZ' in firstLine:
         fileStream.seek(0)
-        return pgzfile.readPgzImage(fileStream)
+        image, dims = pgzfile.readPgzImage(fileStream)
+        return image, dims, None
     # Title is next
-    title = fileStream.readline()
-    params1 = fileStream.readline()
-    params2 = fileStream.readline()
-
-    line = fileStream.readline().decode('ascii')
-    while line:
-        row = [int(x) for x in line.split(' ')]
-        data.append(row)
-        line = fileStream.readline().decode('ascii')
-
-    height = len(data)
-    width = len(data[0])
-    def image(x,y):
-        if x >= 0 and x < width and y >=0 and y < height:
-            return data[y][x]
-        else:
-            raise ValueError('({0}, {1}) not in (0..{2}, 0..{3})'.format(x,y,width-1,height-1))
-    return image, (width, height)
+    title = fileStream.readline().decode('ascii').strip()
+    params1 = fileStream.readline().decode('ascii').strip()
+    params2 = fileStream.readline().decode('ascii').strip()
+    header = RASPHeader(title, params1, params2)
+
+    image = raspgrid.RASPGrid(_parseBody(fileStream, chunkSize))
+    return image, image.dims(), header
+
+# Parse the data into image, (width, height)
+def parseData(fileStream):
+    image, dims, _ = parseDataWithHeader(fileStream)
+    return image, dims
+
+# Format an image as the ASCII of a RASP .data file, which parseData() reads
+# back. 'header' is a RASPHeader, or None for blank header lines.
+def formatData(image, header=None):
+    lines = ['---']
+    lines += [header.title, header.params1, header.params2] if header else ['', '', '']
+    output = io.BytesIO()
+    output.write(str('\n'.join(lines) + '\n').encode('ascii'))
+    numpy.savetxt(output, image.array(), fmt='%d')
+    return output.getvalue()
 
 def featureStats(features):
     N = len(features)
@@ -153,54 +243,60 @@ def learn(features, labels):
     bias = classifier.intercept_[0]
     return weight, bias
 
-def featuresAndLabelsFromDataset(pos, neg, classifier):
+def featuresAndLabelsFromDataset(pos, neg, classifier, gridCache=None):
+    declared = datasource.declaredParameters(classifier)
     features = []
     labels = []
     for item in pos:
-        dataSource = datasource.ArchivedRASPDataSource(item[0])
-        for time in item[1]:
-            dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
-            features.append(classifier.feature(dataTimeSlice))
-            labels.append(1.0)
+        with datasource.ArchivedRASPDataSource(item[0], gridCache, declared) as dataSource:
+            dataSource.preload(classifier.requiredParameters(), item[1])
+            for time in item[1]:
+                dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
+                features.append(classifier.feature(dataTimeSlice))
+                labels.append(1.0)
 
     for item in neg:
-        dataSource = datasource.ArchivedRASPDataSource(item[0])
-        for time in item[1]:
-            dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
-            features.append(classifier.feature(dataTimeSlice))
-            labels.append(0.0)
+        with datasource.ArchivedRASPDataSource(item[0], gridCache, declared) as dataSource:
+            dataSource.preload(classifier.requiredParameters(), item[1])
+            for time in item[1]:
+                dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
+                features.append(classifier.feature(dataTimeSlice))
+                labels.append(0.0)
 
     return features, labels
 
-def evaluateDataset(pos, neg, classifier):
+def evaluateDataset(pos, neg, classifier, gridCache=None):
     nPos = sum(len(item[1]) for item in pos)
     nNeg = sum(len(item[1]) for item in neg)
     truePos = 0
     trueNeg = 0
+    declared = datasource.declaredParameters(classifier)
     print('## Positives ##')
     for item in pos:
-        dataSource = datasource.ArchivedRASPDataSource(item[0])
-        for time in item[1]:
-            dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
-            feature = classifier.feature(dataTimeSlice)
-            _, score = classifier.classify(dataTimeSlice)
-            if score >= classifier.threshold:
-                truePos += 1
-            print(' - {0}-{1}: {2:.3f}'.format(item[0], time, score))
-            print('   Feature: {0}'.format(feature))
-            print('   Score contribution: {0}'.format(['{0:.3f}'.format(x*w) for (x,w) in zip(feature, classifier.weight)]))
+        with datasource.ArchivedRASPDataSource(item[0], gridCache, declared) as dataSource:
+            dataSource.preload(classifier.requiredParameters(), item[1])
+            for time in item[1]:
+                dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
+                feature = classifier.feature(dataTimeSlice)
+                _, score = classifier.classify(dataTimeSlice)
+                if score >= classifier.threshold:
+                    truePos += 1
+                print(' - {0}-{1}: {2:.3f}'.format(item[0], time, score))
+                print('   Feature: {0}'.format(feature))
+                print('   Score contribution: {0}'.format(['{0:.3f}'.format(x*w) for (x,w) in zip(feature, classifier.weight)]))
     print ('## Negatives ##')
     for item in neg:
-        dataSource = datasource.ArchivedRASPDataSource(item[0])
-        for time in item[1]:
-            dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
-            feature = classifier.feature(dataTimeSlice)
-            _, score = classifier.classify(dataTimeSlice)
-            if score < classifier.threshold:
-                trueNeg += 1
-            print(' - {0}-{1}: {2:.3f}'.format(item[0], time, score))
-            print('   Feature: {0}'.format(feature))
-            print('   Score contribution: {0}'.format(['{0:.3f}'.format(x*w) for (x,w) in zip(feature, classifier.weight)]))
+        with datasource.ArchivedRASPDataSource(item[0], gridCache, declared) as dataSource:
+            dataSource.preload(classifier.requiredParameters(), item[1])
+            for time in item[1]:
+                dataTimeSlice = datasource.ArchivedRASPDataTimeSlice(dataSource, time)
+                feature = classifier.feature(dataTimeSlice)
+                _, score = classifier.classify(dataTimeSlice)
+                if score < classifier.threshold:
+                    trueNeg += 1
+                print(' - {0}-{1}: {2:.3f}'.format(item[0], time, score))
+                print('   Feature: {0}'.format(feature))
+                print('   Score contribution: {0}'.format(['{0:.3f}'.format(x*w) for (x,w) in zip(feature, classifier.weight)]))
 
     falseNeg = nPos - truePos
     falsePos = nNeg - trueNeg
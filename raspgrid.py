@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# This file is part of GliderWeatherBot.
+#
+# GliderWeatherBot is copyright Philip G. Lee, 2018.
+#
+# GliderWeatherBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GliderWeatherBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy
+
+# RASP marks missing values with +/- this sentinel
+SENTINEL = 999999
+
+# A 2D grid of RASP values backed by one contiguous int32 array.
+# NOTE: the array is indexed [y, x] with y = 0 at the south edge, but the
+# grid itself is called and sliced in (x, y) order like the old closures.
+class RASPGrid:
+    def __init__(self, data):
+        self.__data = numpy.ascontiguousarray(data, dtype=numpy.int32)
+        if self.__data.ndim != 2:
+            raise ValueError('Grid data must be 2D, not {0}D'.format(self.__data.ndim))
+        self.__validMask = None
+
+    def __call__(self, x, y):
+        height, width = self.__data.shape
+        if x >= 0 and x < width and y >= 0 and y < height:
+            return self.__data.item(y, x)
+        else:
+            raise ValueError('({0}, {1}) not in (0..{2}, 0..{3})'.format(x,y,width-1,height-1))
+
+    # grid[x0:x1, y0:y1] gives a sub-grid; grid[x, y] gives a value
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise IndexError('Grid index must be (x, y)')
+        ret = self.__data[key[1], key[0]]
+        if isinstance(ret, numpy.ndarray):
+            return RASPGrid(ret) if ret.ndim == 2 else ret
+        return ret.item()
+
+    def width(self):
+        return self.__data.shape[1]
+
+    def height(self):
+        return self.__data.shape[0]
+
+    def dims(self):
+        return (self.width(), self.height())
+
+    # The underlying [y, x] array. Do not modify it.
+    def array(self):
+        return self.__data
+
+    # Boolean [y, x] array which is True where the value is not a sentinel
+    def validMask(self):
+        if self.__validMask is None:
+            self.__validMask = (self.__data > -SENTINEL) & (self.__data < SENTINEL)
+        return self.__validMask
+
+    # Sub-grid with lower-left corner (x0, y0) and the given size
+    def region(self, x0, y0, width, height):
+        if width <= 0 or height <= 0 or x0 < 0 or y0 < 0 or x0 + width > self.width() or y0 + height > self.height():
+            raise ValueError('Region ({0}, {1}) + ({2}, {3}) is not inside {4}'.format(x0, y0, width, height, self.dims()))
+        return self[x0:x0 + width, y0:y0 + height]
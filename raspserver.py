@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# This file is part of GliderWeatherBot.
+#
+# GliderWeatherBot is copyright Philip G. Lee, 2018.
+#
+# GliderWeatherBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# GliderWeatherBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+import email.utils
+import hashlib
+import os
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from io import open
+
+import datasource
+import raspdata
+
+# Paths like those of a RASP site, e.g. /OUT+0/FCST/hwcrit.curr.1400lst.d2.data
+DATA_PATH_PATTERN = re.compile(r'^/OUT\+(\d+)/FCST/(\w+)\.curr\.(\d+)lst\.d2\.data$')
+FILE_PATH_PATTERN = re.compile(r'^/OUT\+(\d+)/FCST/([\w.]+)$')
+
+# Responses are written in chunks of this many bytes when throttled
+CHUNK_SIZE = 8192
+
+class RASPRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real servers
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def __sendEmpty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # Abort the connection with a TCP reset
+    def __reset(self):
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.connection.close()
+        self.close_connection = True
+
+    def __write(self, body):
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for begin in range(0, len(body), CHUNK_SIZE):
+            chunk = body[begin:begin + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            time.sleep(float(len(chunk)) / bandwidth)
+
+    def do_GET(self):
+        server = self.server
+        notFound, reset = server.drawFaults()
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        content = None if notFound else server.content(self.path)
+        if content is None:
+            server.count('notFound')
+            self.__sendEmpty(404)
+            return
+        body, mtime = content
+
+        etag = '"{0}"'.format(hashlib.sha1(body).hexdigest()[:16])
+        if self.headers.get('If-None-Match') == etag:
+            server.count('notModified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain' if self.path.endswith('.data') else 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(mtime, usegmt=True))
+        self.end_headers()
+        if reset:
+            # Part of the body, then the connection dies
+            self.__write(body[:len(body) // 2])
+            server.count('resets')
+            self.__reset()
+            return
+        self.__write(body)
+        server.count('bytesSent', len(body))
+
+# A stand-in for a RASP site, serving archived days under the same URL
+# layout so that the network code can be tested and benchmarked offline.
+# 'directories' are archived days as read by ArchivedRASPDataSource, one per
+# day offset. A single directory is served for every day. Data files are
+# sent as ASCII whatever their format on disk, since the clients parse the
+# response as a stream.
+#
+# Faults are injected at random, reproducibly for a given seed: each request
+# waits 'latency' seconds, fails with 404 with probability notFoundRate, or
+# has its connection reset half way with probability resetRate. Responses
+# are sent at no more than 'bandwidth' bytes/s per connection, if given.
+class RASPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directories, address=('127.0.0.1', 0), latency=0.0, bandwidth=None, notFoundRate=0.0, resetRate=0.0, seed=None, verbose=False):
+        HTTPServer.__init__(self, address, RASPRequestHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.notFoundRate = notFoundRate
+        self.resetRate = resetRate
+        self.verbose = verbose
+        self.stats = {'requests': 0, 'notFound': 0, 'notModified': 0, 'resets': 0, 'bytesSent': 0}
+        self.__directories = list(directories)
+        self.__dataSources = dict((directory, datasource.ArchivedRASPDataSource(directory)) for directory in self.__directories)
+        self.__bodies = {}
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+    def count(self, stat, amount=1):
+        with self.__lock:
+            self.stats[stat] += amount
+
+    # Whether the next request should (fail with 404, be reset)
+    def drawFaults(self):
+        with self.__lock:
+            self.stats['requests'] += 1
+            return (self.__random.random() < self.notFoundRate, self.__random.random() < self.resetRate)
+
+    def __directory(self, day):
+        if len(self.__directories) == 1:
+            return self.__directories[0]
+        return self.__directories[day] if day < len(self.__directories) else None
+
+    # Return (body, filename of its source), or None. Data is read from the
+    # file ArchivedRASPDataSource would use, and a .data file is sent as is.
+    def __readContent(self, directory, path):
+        m = DATA_PATH_PATTERN.match(path)
+        if m:
+            dataSource = self.__dataSources[directory]
+            parameter = m.group(2)
+            hour = int(m.group(3))
+            filename = dataSource.sourceFilename(parameter, hour)
+            if filename is None:
+                return None
+            if filename.endswith('.data'):
+                with open(filename, 'rb') as file:
+                    return file.read(), filename
+            try:
+                image, _ = dataSource.data(parameter, hour)
+            except (IOError, OSError):
+                return None
+            return raspdata.formatData(image), filename
+        filename = os.path.join(directory, FILE_PATH_PATTERN.match(path).group(2))
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as file:
+            return file.read(), filename
+
+    # Return (body, mtime) for the URL path, or None if there is nothing
+    # there. The mtime is that of the file the body comes from. Bodies are
+    # converted once and kept.
+    def content(self, path):
+        m = FILE_PATH_PATTERN.match(path)
+        if not m:
+            return None
+        directory = self.__directory(int(m.group(1)))
+        if directory is None:
+            return None
+        key = (directory, path)
+        with self.__lock:
+            content = self.__bodies.get(key)
+        if content is None:
+            content = self.__readContent(directory, path)
+            if content is None:
+                return None
+            with self.__lock:
+                self.__bodies[key] = content
+        body, filename = content
+        try:
+            return body, os.path.getmtime(filename or directory)
+        except OSError:
+            return body, os.path.getmtime(directory)
+
+    # Also closes the archived days
+    def server_close(self):
+        HTTPServer.server_close(self)
+        for dataSource in self.__dataSources.values():
+            dataSource.close()
+
+    # Serve from a background thread
+    def start(self):
+        self.__thread = threading.Thread(target=self.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.__thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+    def __exit__(self, *args):
+        self.stop()
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve archived RASP days like a RASP site, for offline testing')
+    parser.add_argument('directories', type=str, nargs='+', help='Archived days to serve as OUT+0, OUT+1, ... or one to serve for every day')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, metavar='s', help='Delay before each response')
+    parser.add_argument('--bandwidth', type=float, default=None, metavar='KB/s', help='Rate limit of each connection')
+    parser.add_argument('--not-found-rate', type=float, default=0.0, metavar='p', help='Probability that a request fails with 404')
+    parser.add_argument('--reset-rate', type=float, default=0.0, metavar='p', help='Probability that a connection is reset half way through a response')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the fault injection')
+    args = parser.parse_args()
+
+    server = RASPServer(
+        args.directories,
+        (args.host, args.port),
+        latency=args.latency,
+        bandwidth=args.bandwidth * 1024 if args.bandwidth else None,
+        notFoundRate=args.not_found_rate,
+        resetRate=args.reset_rate,
+        seed=args.seed,
+        verbose=True
+    )
+    print('Serving on {0}'.format(server.url()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(server.stats)
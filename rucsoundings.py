@@ -3,7 +3,9 @@
 import datetime
 import math
 import re
-from builtins import range
+from builtins import range, zip
+
+import numpy
 
 try:
     from urllib.parse import urlparse, urlencode
@@ -14,17 +16,24 @@ except ImportError:
     from urllib import urlencode
     from urllib2 import urlopen, Request, HTTPError
 
-# Get the URL for the text sounding
+SOUNDINGS_URL = 'https://rucsoundings.noaa.gov/get_soundings.cgi'
+
+# Get the URL for the text soundings valid from startDateTime (UTC) up to,
+# but not including, endDateTime. The response has one sounding per hour.
 # location can be an airport like 'KCVH' or '<lat>,<long>' in decimal format
-def urlForSounding(location, model, dateTime):
+def urlForSoundings(location, model, startDateTime, endDateTime, baseURL=SOUNDINGS_URL):
     if model not in ('Op40', 'Bak40', 'Bak13', 'FIM', 'GFS', 'NAM', 'RAOB'):
-        raise ValueError('{0} is not a valid model')
+        raise ValueError('{0} is not a valid model'.format(model))
     epoch = datetime.datetime.utcfromtimestamp(0)
-    timeStart = (dateTime - epoch).total_seconds()
-    timeEnd = timeStart + 3600
-    url = 'https://rucsoundings.noaa.gov/get_soundings.cgi?data_source={0}&startSecs={1}&endSecs={2}&fcst_len=shortest&airport={3}'.format(model, timeStart, timeEnd,location)
+    timeStart = (startDateTime - epoch).total_seconds()
+    timeEnd = (endDateTime - epoch).total_seconds()
+    url = '{0}?data_source={1}&startSecs={2}&endSecs={3}&fcst_len=shortest&airport={4}'.format(baseURL, model, timeStart, timeEnd, location)
     return url
 
+# Get the URL for the text sounding
+def urlForSounding(location, model, dateTime):
+    return urlForSoundings(location, model, dateTime, dateTime + datetime.timedelta(hours=1))
+
 def parseSounding(file):
     # https://rucsoundings.noaa.gov/raob_format.html
     # First six lines are informational
@@ -59,6 +68,189 @@ def parseSounding(file):
 
     return ret, surfaceNdx
 
+# Keys of the levels from parseSounding() and the matching Sounding arrays
+LEVEL_KEYS = (
+    ('pressure',       'pressure'),
+    ('altitude',       'altitude'),
+    ('temperature',    'temperature'),
+    ('dewpoint',       'dewpoint'),
+    ('wind-direction', 'windDirection'),
+    ('wind-speed',     'windSpeed')
+)
+
+# These SHOULD be 9.8 deg/km and 2.0 deg/km respectively, but that
+# does not line up with the 2.5 deg/1000ft combined lapse rate that
+# us pilots are taught. That would be 8.2 deg/km.
+DRY_ADIABATIC_LAPSE_RATE_DEGC_PER_M = 10.0 / 1000.0
+DEWPOINT_LAPSE_RATE_DEGC_PER_M = 1.8 / 1000.0
+
+# A sounding as one array per quantity, ordered by increasing altitude, in
+# the units of parseSounding(). surfaceNdx is the index of the surface level,
+# or -1 if there is none.
+class Sounding:
+    def __init__(self, pressure, altitude, temperature, dewpoint, windDirection, windSpeed, surfaceNdx=-1):
+        self.pressure = numpy.asarray(pressure, dtype=numpy.float64)
+        self.altitude = numpy.asarray(altitude, dtype=numpy.float64)
+        self.temperature = numpy.asarray(temperature, dtype=numpy.float64)
+        self.dewpoint = numpy.asarray(dewpoint, dtype=numpy.float64)
+        self.windDirection = numpy.asarray(windDirection, dtype=numpy.float64)
+        self.windSpeed = numpy.asarray(windSpeed, dtype=numpy.float64)
+        self.surfaceNdx = surfaceNdx
+        if numpy.any(numpy.diff(self.altitude) < 0):
+            raise ValueError('Sounding altitudes must not decrease')
+
+    # From the list of levels returned by parseSounding()
+    @staticmethod
+    def fromLevels(levels, surfaceNdx=-1):
+        return Sounding(*[[level[key] for level in levels] for (key, _) in LEVEL_KEYS], surfaceNdx=surfaceNdx)
+
+    # Back to a list of levels like parseSounding() returns
+    def levels(self):
+        arrays = [getattr(self, attribute) for (_, attribute) in LEVEL_KEYS]
+        return [dict((key, float(array[i])) for ((key, _), array) in zip(LEVEL_KEYS, arrays)) for i in range(len(self))]
+
+    def __len__(self):
+        return len(self.altitude)
+
+    def __eq__(self, other):
+        return isinstance(other, Sounding) and self.surfaceNdx == other.surfaceNdx and all(
+            numpy.array_equal(getattr(self, attribute), getattr(other, attribute)) for (_, attribute) in LEVEL_KEYS)
+    def __ne__(self, other):
+        return not self == other
+
+    # Interpolate linearly to each of 'altitudes', a number or an array.
+    # Returns a dict like a level from parseSounding() with values of the
+    # same shape as 'altitudes'. Wind direction turns the short way round and
+    # stays in [0, 360). Below the lowest level that level is returned, and
+    # above the highest the values are NaN.
+    def interpolate(self, altitudes):
+        if len(self) < 2:
+            raise ValueError('Cannot interpolate a sounding with {0} levels'.format(len(self)))
+        altitudes = numpy.asarray(altitudes, dtype=numpy.float64)
+        # First level above each altitude
+        upper = numpy.searchsorted(self.altitude, altitudes, side='right')
+        above = upper >= len(self)
+        upper = numpy.clip(upper, 1, len(self) - 1)
+        lower = upper - 1
+        span = self.altitude[upper] - self.altitude[lower]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            pct = numpy.where(span > 0, (altitudes - self.altitude[lower]) / span, 0.0)
+        pct = numpy.clip(pct, 0.0, 1.0)
+
+        ret = {}
+        for (key, attribute) in LEVEL_KEYS:
+            values = getattr(self, attribute)
+            if key == 'wind-direction':
+                delta = (values[upper] - values[lower]) % 360.0
+                delta = 2.0 * delta % 360.0 - delta
+                value = (values[lower] + pct * delta) % 360.0
+            else:
+                value = values[lower] + pct * (values[upper] - values[lower])
+            value = numpy.where(above, numpy.nan, value)
+            ret[key] = value if value.ndim else float(value)
+        return ret
+
+    # Altitude where the temperature first drops below zero, or None
+    def freezingLevel(self):
+        below = numpy.nonzero(self.temperature < 0)[0]
+        if len(below) == 0:
+            return None
+        i = below[0]
+        if i == 0:
+            return float(self.altitude[0])
+        pct = (0.0 - self.temperature[i-1]) / (self.temperature[i] - self.temperature[i-1])
+        return float(self.altitude[i-1] + pct * (self.altitude[i] - self.altitude[i-1]))
+
+    # Cloudbase for each of 'surfaceTemps_C', a number or an array, like
+    # condenstationLevel()
+    def condenstationLevel(self, surfaceTemps_C):
+        if self.surfaceNdx < 0:
+            raise ValueError('Sounding has no surface level')
+        surfaceTemps_C = numpy.asarray(surfaceTemps_C, dtype=numpy.float64)
+        ret = self.altitude[self.surfaceNdx] + (surfaceTemps_C - self.dewpoint[self.surfaceNdx]) / (DRY_ADIABATIC_LAPSE_RATE_DEGC_PER_M - DEWPOINT_LAPSE_RATE_DEGC_PER_M)
+        return ret if ret.ndim else float(ret)
+
+    # A dict of lists for json.dumps(), and back
+    def toJSON(self):
+        ret = dict((attribute, getattr(self, attribute).tolist()) for (_, attribute) in LEVEL_KEYS)
+        ret['surfaceNdx'] = self.surfaceNdx
+        return ret
+    @staticmethod
+    def fromJSON(value):
+        return Sounding(*[value[attribute] for (_, attribute) in LEVEL_KEYS], surfaceNdx=value['surfaceNdx'])
+
+# RAOB marks missing values with this
+MISSING = 99999
+
+# The second header line of each sounding, e.g. 'GFS 21 26 Nov 2018'
+SOUNDING_DATE_PATTERN = re.compile(r'^\s*\S+\s+(\d+)\s+(\d+)\s+([A-Za-z]{3})\s+(\d{4})\s*$')
+
+# Types of the lines holding levels. 9 is the surface.
+LEVEL_TYPES = (4, 5, 6, 7, 8, 9)
+SURFACE_TYPE = 9
+
+# Columns of the level lines: type, pressure (tenths of mb), altitude (m),
+# temperature and dewpoint (tenths of C), wind direction (deg), wind speed
+def _soundingFromColumns(columns):
+    columns = columns.astype(numpy.float64)
+    columns[columns == MISSING] = numpy.nan
+    # A level is no use without its height
+    columns = columns[~numpy.isnan(columns[:, 2])]
+    columns = columns[numpy.argsort(columns[:, 2], kind='mergesort')]
+    surface = numpy.nonzero(columns[:, 0] == SURFACE_TYPE)[0]
+    return Sounding(
+        columns[:, 1] / 10.0,
+        columns[:, 2],
+        columns[:, 3] / 10.0,
+        columns[:, 4] / 10.0,
+        columns[:, 5],
+        columns[:, 6],
+        surfaceNdx=int(surface[0]) if len(surface) else -1
+    )
+
+# Parse every sounding in a response (https://rucsoundings.noaa.gov/raob_format.html),
+# which may cover many hours, into a list of (valid time, Sounding). The
+# valid time is the UTC datetime from each sounding's header. Missing values
+# come out as NaN, except that levels without an altitude are left out. A
+# level line that is not seven integers raises ValueError.
+def parseSoundings(file):
+    text = file.read()
+    if isinstance(text, bytes):
+        text = text.decode('ascii', 'replace')
+    lines = text.splitlines()
+
+    # Each sounding is a title line, the date line, then info lines and
+    # level lines up to a blank line or the next sounding
+    headers = [i for i in range(1, len(lines)) if SOUNDING_DATE_PATTERN.match(lines[i])]
+    ret = []
+    for (n, dateNdx) in enumerate(headers):
+        end = headers[n+1] - 1 if n + 1 < len(headers) else len(lines)
+        begin = dateNdx + 1
+        while begin < end:
+            tokens = lines[begin].split()
+            if tokens and tokens[0].isdigit() and int(tokens[0]) in LEVEL_TYPES:
+                break
+            begin += 1
+        block = lines[begin:end]
+        while block and not block[-1].strip():
+            block.pop()
+
+        tokens = ' '.join(block).split()
+        try:
+            columns = numpy.array(tokens, dtype=numpy.int64).reshape(-1, 7)
+            if any(len(line.split()) != 7 for line in block):
+                raise ValueError()
+        except ValueError:
+            for (i, line) in enumerate(block):
+                if len(line.split()) != 7 or not all(re.match(r'^-?\d+$', token) for token in line.split()):
+                    raise ValueError('Bad sounding level on line {0}: {1!r}'.format(begin + i + 1, line))
+            raise
+
+        m = SOUNDING_DATE_PATTERN.match(lines[dateNdx])
+        validTime = datetime.datetime.strptime('{0} {1} {2} {3}'.format(*m.groups()), '%H %d %b %Y')
+        ret.append((validTime, _soundingFromColumns(columns)))
+    return ret
+
 def interpolateSounding(sounding, altitude):
     def shortestAngle(a0, a1):
         da = (a1 - a0) % 360.0
@@ -100,13 +292,8 @@ def freezingLevel(sounding):
 # NOTE: in the future, maybe parse https://forecast.weather.gov/MapClick.php?lat=36.8525&lon=-121.4033&FcstType=digitalDWML
 # in order to get the maximum surface temperature during the day
 def condenstationLevel(sounding, surfaceNdx, surfaceTemp_C):
-    # These SHOULD be 9.8 deg/km and 2.0 deg/km respectively, but that
-    # does not line up with the 2.5 deg/1000ft combined lapse rate that
-    # us pilots are taught. That would be 8.2 deg/km.
-    dryAdiabaticLapseRate_degCPerM = 10.0 / 1000.0
-    dewpointLapseRate_degCPerM = 1.8 / 1000.0
     surfaceDewpoint_C = sounding[surfaceNdx]['dewpoint']
-    return sounding[surfaceNdx]['altitude'] + (surfaceTemp_C - surfaceDewpoint_C) / (dryAdiabaticLapseRate_degCPerM - dewpointLapseRate_degCPerM)
+    return sounding[surfaceNdx]['altitude'] + (surfaceTemp_C - surfaceDewpoint_C) / (DRY_ADIABATIC_LAPSE_RATE_DEGC_PER_M - DEWPOINT_LAPSE_RATE_DEGC_PER_M)
 
 def kPaFromMb(pressure_mb):
     return pressure_mb / 10.0
@@ -114,37 +301,141 @@ def kPaFromMb(pressure_mb):
 def degCFromK(temp_K):
     return temp_K - 273.15
 
-# Return the standard temperature and height for the given pressure
-def standardAtmosphere(pressure_kPa):
-    # http://www-mdp.eng.cam.ac.uk/web/library/enginfo/aerothermal_dvd_only/aero/atmos/atmos.html
-    g_ms = 9.8
-    R = 287.0
-    T0_K = 19.0 + 273.15
-    h0_m = -610.0
-    #L_Cm = 0.0065
-    L_Cm = (55.0 + 19.0) / (11000.0 + 610.0)
-    P0_kPa = 108.9
-
-    # Tropopause
-    Ts = -55.0 + 273.15
-    Ps = 22.632
-    hs = h0_m + (T0_K - Ts) / L_Cm # == 11.000km
-
-    # P / P0 = (T / T0)^(g/(LR))
+# Standard atmosphere, from
+# http://www-mdp.eng.cam.ac.uk/web/library/enginfo/aerothermal_dvd_only/aero/atmos/atmos.html
+G_MS = 9.8
+R = 287.0
+T0_K = 19.0 + 273.15
+H0_M = -610.0
+#L_CM = 0.0065
+L_CM = (55.0 + 19.0) / (11000.0 + 610.0)
+P0_KPA = 108.9
+# P / P0 = (T / T0)^(g/(LR))
+EXPONENT = L_CM * R / G_MS
+
+# Tropopause
+TS_K = -55.0 + 273.15
+PS_KPA = 22.632
+HS_M = H0_M + (T0_K - TS_K) / L_CM # == 11.000km
+# Where the temperature reaches TS_K and the formulas switch. NOTE: the
+# height jumps by about 40m here, since PS_KPA is not quite this.
+TROPOPAUSE_KPA = P0_KPA * math.pow(TS_K / T0_K, 1.0 / EXPONENT)
+
+# Each formula for numbers or arrays
+def _troposphere(pressure_kPa):
     # (P / P0)^(LR/g) = T/T0
     # T = T0 * (P/P0)^(LR/g)
-    T = T0_K * math.pow(pressure_kPa / P0_kPa, L_Cm * R / g_ms)
-    if T >= Ts:
-        h = h0_m + (T0_K - T) / L_Cm
-    else:
-        # log(P/Ps) = g (hs - h) / (R Ts)
-        # (R Ts / g) log(P/Ps) = hs - h
-        T = Ts
-        h = hs - (R * Ts / g_ms) * math.log(pressure_kPa / Ps)
+    T = T0_K * numpy.power(pressure_kPa / P0_KPA, EXPONENT)
+    return T, H0_M + (T0_K - T) / L_CM
+def _stratosphere(pressure_kPa):
+    # log(P/Ps) = g (hs - h) / (R Ts)
+    # (R Ts / g) log(P/Ps) = hs - h
+    return numpy.full_like(pressure_kPa, TS_K), HS_M - (R * TS_K / G_MS) * numpy.log(pressure_kPa / PS_KPA)
+
+# Return the standard temperature and height for the given pressure, which
+# may be a number or an array
+def standardAtmosphere(pressure_kPa):
+    if numpy.ndim(pressure_kPa) == 0:
+        T = T0_K * math.pow(pressure_kPa / P0_KPA, EXPONENT)
+        if T >= TS_K:
+            h = H0_M + (T0_K - T) / L_CM
+        else:
+            T = TS_K
+            h = HS_M - (R * TS_K / G_MS) * math.log(pressure_kPa / PS_KPA)
+        return T, h
 
+    pressure_kPa = numpy.asarray(pressure_kPa, dtype=numpy.float64)
+    T, h = _troposphere(pressure_kPa)
+    stratosphere = T < TS_K
+    if numpy.any(stratosphere):
+        Ts, hs = _stratosphere(pressure_kPa[stratosphere])
+        T[stratosphere] = Ts
+        h[stratosphere] = hs
     return T, h
 
+# standardAtmosphere() for arrays by linear interpolation in a table of
+# equal pressure steps, which avoids any pow() or log() per value. The steps
+# are fitted so that TROPOPAUSE_KPA falls on a node, since the height jumps
+# there. Pressures outside [minPressure_kPa, maxPressure_kPa] are computed
+# exactly. NOTE: numpy's vectorized pow() is about as fast, so see
+# benchmarkStandardAtmosphere() before reaching for this.
+#
+# Linear interpolation with step dP is off by at most dP^2/8 * max|f''|.
+# Both T'' and h'' shrink with pressure, so their maxima are at the low end
+# of each side of the tropopause:
+#   troposphere:  h'' = (T0/L) k (1-k) (P/P0)^k / P^2, T'' = L h''
+#   stratosphere: h'' = (R Ts/g) / P^2,                T'' = 0
+# with k = LR/g. errorBound() evaluates this. With the defaults it is about
+# 0.08m and 0.0001K.
+class StandardAtmosphereTable:
+    def __init__(self, minPressure_kPa=10.0, maxPressure_kPa=110.0, size=1024):
+        self.__minPressure = minPressure_kPa
+        self.__maxPressure = maxPressure_kPa
+        if minPressure_kPa < TROPOPAUSE_KPA < maxPressure_kPa:
+            stratosphereSteps = max(1, int(round(size * (TROPOPAUSE_KPA - minPressure_kPa) / (maxPressure_kPa - minPressure_kPa))))
+            self.__step = (TROPOPAUSE_KPA - minPressure_kPa) / stratosphereSteps
+        else:
+            stratosphereSteps = size if maxPressure_kPa <= TROPOPAUSE_KPA else 0
+            self.__step = (maxPressure_kPa - minPressure_kPa) / size
+        steps = int(math.ceil((maxPressure_kPa - minPressure_kPa) / self.__step - 1e-9))
+
+        # Each step has its own T = a + b x, h = c + d x for x in [0, 1)
+        left = minPressure_kPa + self.__step * numpy.arange(steps)
+        right = left + self.__step
+        T = [numpy.empty(steps), numpy.empty(steps)]
+        h = [numpy.empty(steps), numpy.empty(steps)]
+        for (formula, sides) in ((_stratosphere, slice(0, stratosphereSteps)), (_troposphere, slice(stratosphereSteps, steps))):
+            for (end, pressures) in enumerate((left, right)):
+                T[end][sides], h[end][sides] = formula(pressures[sides])
+        self.__offsetT, self.__slopeT = T[0], T[1] - T[0]
+        self.__offsetH, self.__slopeH = h[0], h[1] - h[0]
+        self.__stratosphereSteps = stratosphereSteps
+
+    # Largest (temperature, height) error of the table
+    def errorBound(self):
+        bound = [0.0, 0.0]
+        if self.__stratosphereSteps > 0:
+            bound[1] = (R * TS_K / G_MS) / self.__minPressure**2
+        if self.__stratosphereSteps < len(self.__offsetH):
+            begin = max(self.__minPressure, TROPOPAUSE_KPA)
+            curvature = (T0_K / L_CM) * EXPONENT * (1.0 - EXPONENT) * math.pow(begin / P0_KPA, EXPONENT) / begin**2
+            bound = [L_CM * curvature, max(bound[1], curvature)]
+        return tuple(self.__step**2 / 8.0 * x for x in bound)
+
+    # Return the standard temperature and height for an array of pressures
+    def __call__(self, pressure_kPa):
+        pressure_kPa = numpy.asarray(pressure_kPa, dtype=numpy.float64)
+        position = (pressure_kPa - self.__minPressure) * (1.0 / self.__step)
+        i = numpy.clip(position.astype(numpy.intp), 0, len(self.__offsetH) - 1)
+        fraction = position - i
+        T = self.__offsetT[i] + fraction * self.__slopeT[i]
+        h = self.__offsetH[i] + fraction * self.__slopeH[i]
+        outside = (pressure_kPa < self.__minPressure) | (pressure_kPa > self.__maxPressure)
+        if numpy.any(outside):
+            T[outside], h[outside] = standardAtmosphere(pressure_kPa[outside])
+        return T, h
+
+# Time the scalar, array and table versions of standardAtmosphere() on n
+# pressures and print the results
+def benchmarkStandardAtmosphere(n=10**6):
+    import timeit
+    pressure_kPa = numpy.random.RandomState(0).uniform(20.0, 105.0, n)
+    table = StandardAtmosphereTable()
+    scalarPressures = pressure_kPa[:n // 100].tolist()
+    scalar = timeit.timeit(lambda: [standardAtmosphere(P) for P in scalarPressures], number=1) * 100
+    vectorized = min(timeit.repeat(lambda: standardAtmosphere(pressure_kPa), number=1, repeat=5))
+    tabulated = min(timeit.repeat(lambda: table(pressure_kPa), number=1, repeat=5))
+    print('{0} pressures:'.format(n))
+    print('  scalar:     {0:.3f}s (estimated from {1})'.format(scalar, len(scalarPressures)))
+    print('  vectorized: {0:.3f}s ({1:.0f}x)'.format(vectorized, scalar / vectorized))
+    print('  tabulated:  {0:.3f}s ({1:.0f}x)'.format(tabulated, scalar / tabulated))
+    print('  table error bound: {0:.2g}K {1:.2g}m'.format(*table.errorBound()))
+
 if __name__=='__main__':
+    import sys
+    if '--benchmark' in sys.argv:
+        benchmarkStandardAtmosphere()
+        sys.exit(0)
     for P_mb in (1000, 850, 750, 700, 228, 200, 150):
         T, h = standardAtmosphere(kPaFromMb(P_mb))
         print('P: {0} T: {1} h: {2}'.format(P_mb, (T - 273.15), h*3.28))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import datetime
+import os
+import shutil
+import threading
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+import datasource
+import gridcache
+import pgzfile
+import raspgrid
+import raspserver
+import test_rucsoundings
+
+# Serves the files under /tmp/datasource-test. SimpleHTTPRequestHandler
+# only takes a directory argument from Python 3.7.
+class QuietHandler(SimpleHTTPRequestHandler):
+    def translate_path(self, path):
+        return os.path.join('/tmp/datasource-test', path.split('?')[0].lstrip('/'))
+    def log_message(self, *args):
+        pass
+
+def test_prefetch():
+    shutil.rmtree('/tmp/datasource-test', ignore_errors=True)
+    requests = []
+    for day in (0, 1):
+        os.makedirs('/tmp/datasource-test/OUT+{0}/FCST'.format(day))
+        for parameter in ('hwcrit', 'wstar'):
+            for time in (1300, 1400):
+                with open('/tmp/datasource-test/OUT+{0}/FCST/{1}.curr.{2}lst.d2.data'.format(day, parameter, time), 'w') as file:
+                    file.write('---\ntitle\nparams1\nparams2\n{0} {1}\n'.format(day, time))
+                requests.append((parameter, day, time))
+
+    directories = ['/tmp/datasource-test/OUT+{0}/FCST'.format(day) for day in (0, 1)]
+    with raspserver.RASPServer(directories) as server:
+        memoryCache = gridcache.GridMemoryCache()
+        dataSource = datasource.WebRASPDataSource(server.url(), memoryCache=memoryCache)
+        dataSource.prefetch(requests + [('missing', 0, 1400)], maxWorkers=3)
+        # A second source sharing the cache needs no requests either
+        otherSource = datasource.WebRASPDataSource(server.url(), memoryCache=memoryCache)
+
+    # Everything should now come from memory
+    for (parameter, day, time) in requests:
+        image, dims = dataSource.data(parameter, day, time)
+        assert dims == (2, 1)
+        assert (image(0, 0), image(1, 0)) == (day, time)
+        assert otherSource.data(parameter, day, time)[0] is image
+    assert (memoryCache.hits, memoryCache.misses) == (2 * len(requests), len(requests))
+
+def test_declaredParameters():
+    dataSource = datasource.ArchivedRASPDataSource('test-data', declaredParameters=set(['hwcrit']))
+    dataSource.data('hwcrit', 1400)
+    try:
+        dataSource.data('wstar', 1400)
+        assert False
+    except ValueError:
+        pass
+
+def test_soundings():
+    shutil.rmtree('/tmp/datasource-test', ignore_errors=True)
+    os.makedirs('/tmp/datasource-test')
+    with open('/tmp/datasource-test/soundings.txt', 'w') as file:
+        file.write(test_rucsoundings.SOUNDINGS)
+    start = datetime.datetime(2018, 11, 26, 21)
+    end = datetime.datetime(2018, 11, 26, 22, 30)
+
+    server = HTTPServer(('127.0.0.1', 0), QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        baseURL = 'http://127.0.0.1:{0}/soundings.txt'.format(server.server_address[1])
+        dataSource = datasource.WebSoundingDataSource('KCVH', cacheDirectory='/tmp/datasource-test/cache', baseURL=baseURL)
+        soundings = dataSource.soundings(start, end)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert sorted(soundings.keys()) == [start, start + datetime.timedelta(hours=1)]
+    assert len(os.listdir('/tmp/datasource-test/cache')) == 2
+
+    # Past hours come from the disk cache with the server gone
+    cachedSource = datasource.WebSoundingDataSource('KCVH', cacheDirectory='/tmp/datasource-test/cache', baseURL=baseURL)
+    sounding = cachedSource.sounding(start + datetime.timedelta(minutes=40))
+    assert sounding == soundings[start]
+    assert sounding.surfaceNdx == 0
+
+def test_deltaData():
+    shutil.rmtree('/tmp/datasource-test', ignore_errors=True)
+    os.makedirs('/tmp/datasource-test')
+    images = dict((time, raspgrid.RASPGrid([[time, time + 1]])) for time in (1300, 1400, 1500))
+    with open('/tmp/datasource-test/hwcrit.curr.d2.data.pgzd', 'wb') as file:
+        pgzfile.writePgzDeltaImages(images, (2, 1), file)
+    # An hourly file is used before the day of deltas
+    with open('/tmp/datasource-test/hwcrit.curr.1500lst.d2.data', 'w') as file:
+        file.write('---\ntitle\nparams1\nparams2\n7 8\n')
+
+    memoryCache = gridcache.GridMemoryCache()
+    archived = datasource.ArchivedRASPDataSource('/tmp/datasource-test', memoryCache=memoryCache)
+    archived.preload(['hwcrit'], [1300, 1400], maxWorkers=2)
+    # The day is decoded once, and every hour of it is in the memory cache
+    assert (memoryCache.hits, memoryCache.misses) == (1, 3)
+    image, dims = archived.data('hwcrit', 1400)
+    assert dims == (2, 1) and image(1, 0) == 1401
+    assert memoryCache.hits == 2
+    image, _ = archived.data('hwcrit', 1500)
+    assert image(0, 0) == 7
+    region, dims = archived.dataRegion('hwcrit', 1300, 1, 0, 1, 1)
+    assert dims == (1, 1) and region(0, 0) == 1301
+
+    for (parameter, time) in (('hwcrit', 1600), ('wstar', 1400)):
+        try:
+            archived.data(parameter, time)
+            assert False
+        except IOError:
+            pass
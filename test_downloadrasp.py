@@ -1,7 +1,14 @@
 #!/usr/bin/env python
 
+import os
+import shutil
 import subprocess
 
+import raspserver
+
 def test_download():
-    subprocess.check_call(['./download-rasp.py', '--binary', '--output=/tmp/'])
-    subprocess.call(['rm', '/tmp/*.pgz'])
+    shutil.rmtree('/tmp/downloadrasp-test', ignore_errors=True)
+    os.makedirs('/tmp/downloadrasp-test')
+    with raspserver.RASPServer(['test-data']) as server:
+        subprocess.check_call(['./download-rasp.py', '--binary', '--output=/tmp/downloadrasp-test', '--url', server.url(), '--times', '1400'])
+    assert sorted(os.listdir('/tmp/downloadrasp-test')) == sorted(os.listdir('test-data'))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+
+import numpy
+
+import datasource
+import gridcache
+import utilities
+
+def test_gridCache():
+    shutil.rmtree('/tmp/gridcache-test', ignore_errors=True)
+    shutil.copytree('test-data', '/tmp/gridcache-test/data')
+    cache = gridcache.GridFileCache('/tmp/gridcache-test/cache')
+    archived = datasource.ArchivedRASPDataSource('test-data')
+
+    # A new source each time, so that its memory cache does not hide the files
+    for i in range(2):
+        cached = datasource.ArchivedRASPDataSource('/tmp/gridcache-test/data', cache)
+        image, dims = cached.data('hwcrit', 1400)
+        expected, expectedDims = archived.data('hwcrit', 1400)
+        assert dims == expectedDims
+        assert image.array().tolist() == expected.array().tolist()
+    assert (cache.hits, cache.misses) == (1, 1)
+    # The second read maps the cache file instead of copying it
+    assert isinstance(image.array().base, numpy.memmap) or isinstance(image.array(), numpy.memmap)
+
+    # Changing the source invalidates the cached grid
+    source = '/tmp/gridcache-test/data/hwcrit.curr.1400lst.d2.data.pgz'
+    stat = os.stat(source)
+    os.utime(source, (stat.st_atime, stat.st_mtime + 10))
+    datasource.ArchivedRASPDataSource('/tmp/gridcache-test/data', cache).data('hwcrit', 1400)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_eviction():
+    shutil.rmtree('/tmp/gridcache-test', ignore_errors=True)
+    gridSize = gridcache.HEADER_SIZE + 4 * 110 * 130
+    cache = gridcache.GridFileCache('/tmp/gridcache-test/cache', 2 * gridSize)
+    cached = datasource.ArchivedRASPDataSource('test-data', cache)
+    for parameter in ('hwcrit', 'wstar', 'sfcsunpct'):
+        cached.data(parameter, 1400)
+    assert cache.evictions == 1
+    assert len(os.listdir('/tmp/gridcache-test/cache')) == 2
+
+def test_memoryCache():
+    archived = datasource.ArchivedRASPDataSource('test-data')
+    gridSize = 4 * 110 * 130
+    cache = gridcache.GridMemoryCache(2 * gridSize)
+    for parameter in ('hwcrit', 'wstar', 'hwcrit', 'sfcsunpct', 'wstar'):
+        image, dims = cache.data(parameter, lambda: archived.data(parameter, 1400))
+        assert dims == (110, 130)
+    # hwcrit was used more recently than wstar when sfcsunpct came in
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 4, 2)
+    assert 'sfcsunpct' in cache and 'hwcrit' not in cache
+    assert cache.bytes() == 2 * gridSize
+
+def test_archivedMemoryCache(monkeypatch):
+    shutil.rmtree('/tmp/gridcache-test', ignore_errors=True)
+    shutil.copytree('test-data', '/tmp/gridcache-test/data')
+    memoryCache = gridcache.GridMemoryCache()
+    archived = datasource.ArchivedRASPDataSource('/tmp/gridcache-test/data', memoryCache=memoryCache)
+    archived.preload(['hwcrit', 'wstar', 'sfcsunpct'], [1400])
+    assert (memoryCache.hits, memoryCache.misses) == (0, 3)
+    image, _ = archived.data('hwcrit', 1400)
+    assert archived.data('hwcrit', 1400)[0] is image
+    region, dims = archived.dataRegion('wstar', 1400, 10, 20, 5, 6)
+    assert dims == (5, 6)
+    assert (memoryCache.hits, memoryCache.misses) == (3, 3)
+
+    # Hits do not stat the files again
+    stats = []
+    osStat = os.stat
+    monkeypatch.setattr(os, 'stat', lambda filename: stats.append(filename) or osStat(filename))
+    assert archived.data('hwcrit', 1400)[0] is image
+    assert stats == []
+
+    # Changing the source file makes it miss after the next preload()
+    source = '/tmp/gridcache-test/data/hwcrit.curr.1400lst.d2.data.pgz'
+    stat = osStat(source)
+    os.utime(source, (stat.st_atime, stat.st_mtime + 10))
+    assert archived.data('hwcrit', 1400)[0] is image
+    archived.preload(['hwcrit'], [1400])
+    assert archived.data('hwcrit', 1400)[0] is not image
+    assert memoryCache.misses == 4
+
+def test_directorySizeLimit(monkeypatch):
+    shutil.rmtree('/tmp/gridcache-test', ignore_errors=True)
+    os.makedirs('/tmp/gridcache-test')
+    def write(name, size, mtime):
+        filename = os.path.join('/tmp/gridcache-test', name)
+        with open(filename, 'wb') as file:
+            file.write(b'x' * size)
+        os.utime(filename, (mtime, mtime))
+        return filename
+    write('old.grid', 100, 1000)
+    write('other.txt', 1000, 1000)
+    limit = utilities.DirectorySizeLimit('/tmp/gridcache-test', '.grid', 250)
+    assert limit.total() == 100
+
+    # Under the limit the directory is not listed again
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda directory: listings.append(directory) or listdir(directory))
+    assert limit.written(write('a.grid', 100, 2000)) == 0
+    assert limit.written(write('a.grid', 50, 2000)) == 0
+    assert limit.total() == 150 and listings == []
+
+    # Over it, the least recently used go first
+    assert limit.written(write('b.grid', 150, 3000)) == 1
+    assert len(listings) == 1
+    assert sorted(os.listdir('/tmp/gridcache-test')) == ['a.grid', 'b.grid', 'other.txt']
+    assert limit.total() == 200
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import threading
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+import datasource
+import httpcache
+
+# Serves the files under /tmp/httpcache-test/www. SimpleHTTPRequestHandler
+# only takes a directory argument from Python 3.7.
+class QuietHandler(SimpleHTTPRequestHandler):
+    def translate_path(self, path):
+        return os.path.join('/tmp/httpcache-test/www', path.split('?')[0].lstrip('/'))
+    def log_message(self, *args):
+        pass
+
+def test_httpCache():
+    shutil.rmtree('/tmp/httpcache-test', ignore_errors=True)
+    os.makedirs('/tmp/httpcache-test/www/OUT+0/FCST')
+    filename = '/tmp/httpcache-test/www/OUT+0/FCST/hwcrit.curr.1400lst.d2.data'
+    with open(filename, 'w') as file:
+        file.write('---\ntitle\nparams1\nparams2\n1 2 3\n4 5 6\n')
+
+    server = HTTPServer(('127.0.0.1', 0), QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        baseURL = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+        cache = httpcache.HTTPGridCache('/tmp/httpcache-test/cache')
+        for i in range(3):
+            # A new source each time, like a new run of the bot
+            image, dims = datasource.WebRASPDataSource(baseURL, cache).data('hwcrit', 0, 1400)
+            assert dims == (3, 2)
+            assert image(2, 1) == 6
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        # A changed file is downloaded again
+        with open(filename, 'w') as file:
+            file.write('---\ntitle\nparams1\nparams2\n7 8 9\n')
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+        image, dims = datasource.WebRASPDataSource(baseURL, cache).data('hwcrit', 0, 1400)
+        assert dims == (3, 1)
+        assert (cache.hits, cache.misses) == (2, 2)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -32,3 +32,13 @@ def test_classify():
         c, score = classifier.classify(dataSlice)
         assert type(c) == bool
         assert type(score) == float
+
+def test_requiredParameters():
+    for name in localscore.LocalClassifierFactory.allClassifierNames():
+        classifier = localscore.LocalClassifierFactory.classifier(name)
+        # Reading anything undeclared would raise
+        dataSlice = datasource.ArchivedRASPDataTimeSlice(
+            datasource.ArchivedRASPDataSource('test-data', declaredParameters=set(classifier.requiredParameters())),
+            1400
+        )
+        classifier.classify(dataSlice)
@@ -1,10 +1,17 @@
 #!/usr/bin/env python
 
+import io
+import os
+import struct
 import subprocess
+import zlib
 from builtins import range
 from io import open
 
+import pytest
+
 import pgzfile
+import raspgrid
 
 def test_pgzfile():
     dims = (110, 130)
@@ -19,5 +26,98 @@ def test_pgzfile():
             for x in range(dims[0]):
                 assert data(x, y) == testData(x, y)
 
+def test_format():
+    dims = (7, 5)
+    def data(x,y):
+        return (x - 3) * 100000 * (y + 1)
+    expected = bytes()
+    for y in range(dims[1]):
+        for x in range(dims[0]):
+            expected += struct.pack('>i', data(x, y))
+    with open('/tmp/image.pgz', 'wb') as file:
+        pgzfile.writePgzImage(data, dims, file)
+    with open('/tmp/image.pgz', 'rb') as file:
+        assert file.readline() == b'PGZ 7 5 4294967295\n'
+        assert file.read() == zlib.compress(expected, 9)
+
+def test_streaming():
+    dims = (110, 130)
+    with open('/tmp/image.pgz', 'wb') as file:
+        pgzfile.writePgzImage(lambda x, y: x - y, dims, file)
+    with open('/tmp/image.pgz', 'rb') as file:
+        content = file.read()
+    (testData, testDims) = pgzfile.readPgzImage(io.BytesIO(content), chunkSize=7)
+    assert testDims == dims
+    assert testData(109, 3) == 106
+    with pytest.raises(ValueError):
+        pgzfile.readPgzImage(io.BytesIO(content[:len(content) // 2]))
+    # Bytes after the end of the stream are ignored
+    for chunkSize in (7, 2**16):
+        (testData, _) = pgzfile.readPgzImage(io.BytesIO(content + b'trailing'), chunkSize=chunkSize)
+        assert testData(109, 3) == 106
+
+def test_tiled():
+    dims = (110, 130)
+    def data(x,y):
+        return int(x)*int(y) - 1000
+    for tileSize in (None, (16, 16), (32, 7)):
+        with open('/tmp/image.pgz', 'wb') as file:
+            pgzfile.writePgzImage(data, dims, file, tileSize=tileSize)
+        with open('/tmp/image.pgz', 'rb') as file:
+            (testData, testDims) = pgzfile.readPgzImage(file)
+            assert testDims == dims
+            assert testData.array().tolist() == [[data(x, y) for x in range(dims[0])] for y in range(dims[1])]
+        for (x0, y0, width, height) in ((0, 0, 110, 130), (15, 75, 32, 32), (100, 120, 10, 10), (17, 3, 1, 1)):
+            with open('/tmp/image.pgz', 'rb') as file:
+                (region, regionDims) = pgzfile.readPgzRegion(file, x0, y0, width, height)
+            assert regionDims == (width, height)
+            assert region.array().tolist() == testData.region(x0, y0, width, height).array().tolist()
+        with open('/tmp/image.pgz', 'rb') as file:
+            with pytest.raises(ValueError):
+                pgzfile.readPgzRegion(file, 100, 0, 11, 1)
+
+def test_delta():
+    dims = (31, 17)
+    images = {}
+    for time in (1000, 1100, 1200, 1300):
+        images[time] = raspgrid.RASPGrid([[(x * y + time) if x != y else -999999 for x in range(dims[0])] for y in range(dims[1])])
+    images[1200] = raspgrid.RASPGrid([[999999 - x for x in range(dims[0])] for y in range(dims[1])])
+    with open('/tmp/image.pgzd', 'wb') as file:
+        pgzfile.writePgzDeltaImages(images, dims, file)
+    for times in (None, [1000], [1200, 1100], [1300]):
+        with open('/tmp/image.pgzd', 'rb') as file:
+            testImages = pgzfile.readPgzDeltaImages(file, times, chunkSize=64)
+        assert sorted(testImages.keys()) == sorted(times or images.keys())
+        for time in testImages:
+            (testData, testDims) = testImages[time]
+            assert testDims == dims
+            assert testData.array().tolist() == images[time].array().tolist()
+
+def test_compressDataFile():
+    with open('/tmp/image.data', 'wb') as file:
+        file.write(b'---\ntitle\nparams1\nparams2\n1 2 3\n4 5 6\n')
+    assert pgzfile.compressDataFile('/tmp/image.data', keep=True) > 0
+    # Up to date, so it is skipped but the original is still removed
+    assert pgzfile.compressDataFile('/tmp/image.data') == 0
+    assert not os.path.exists('/tmp/image.data')
+    with open('/tmp/image.data.pgz', 'rb') as file:
+        (testData, testDims) = pgzfile.readPgzImage(file)
+    assert testDims == (3, 2)
+    assert testData(2, 1) == 6
+
+    # A truncated .pgz is written again, even when it is newer
+    with open('/tmp/image.data', 'wb') as file:
+        file.write(b'---\ntitle\nparams1\nparams2\n1 2 3\n4 5 6\n')
+    with open('/tmp/image.data.pgz', 'rb') as file:
+        complete = file.read()
+    for truncated in (complete[:-8], complete[:10], b''):
+        with open('/tmp/image.data.pgz', 'wb') as file:
+            file.write(truncated)
+        stat = os.stat('/tmp/image.data')
+        os.utime('/tmp/image.data.pgz', (stat.st_atime, stat.st_mtime + 10))
+        assert pgzfile.compressDataFile('/tmp/image.data', keep=True) > 0
+        with open('/tmp/image.data.pgz', 'rb') as file:
+            assert pgzfile.readPgzImage(file)[0](2, 1) == 6
+
 def test_help():
     subprocess.check_call(['./pgzfile.py', '--help'])
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+
+import datasource
+import raspbundle
+
+def test_bundleDirectory():
+    shutil.rmtree('/tmp/bundle-test', ignore_errors=True)
+    shutil.copytree('test-data', '/tmp/bundle-test')
+    files = raspbundle.dataFilesInDirectory('/tmp/bundle-test')
+    assert raspbundle.bundleDirectory('/tmp/bundle-test') == ['/tmp/bundle-test/rasp.bundle']
+    assert raspbundle.bundleDirectory('/tmp/bundle-test', perTime=True) == ['/tmp/bundle-test/rasp.1400lst.bundle']
+
+    archived = datasource.ArchivedRASPDataSource('test-data')
+    for filename in ('/tmp/bundle-test/rasp.bundle', '/tmp/bundle-test/rasp.1400lst.bundle'):
+        with raspbundle.RASPBundle(filename) as bundle:
+            assert sorted(bundle.keys()) == sorted(files.keys())
+            for (parameter, time) in files:
+                image, dims = bundle.data(parameter, time)
+                expected, expectedDims = archived.data(parameter, time)
+                assert dims == expectedDims
+                assert image.array().tolist() == expected.array().tolist()
+
+    # Each call decompresses again; the data source's memory cache keeps them
+    with raspbundle.RASPBundle('/tmp/bundle-test/rasp.bundle') as bundle:
+        first, _ = bundle.data('hwcrit', 1400)
+        second, _ = bundle.data('hwcrit', 1400)
+        assert first is not second
+        assert first.array().tolist() == second.array().tolist()
+
+    # The data source should prefer the bundle once the files are gone
+    for filename in files.values():
+        os.remove(filename)
+    bundled = datasource.ArchivedRASPDataSource('/tmp/bundle-test')
+    image, dims = bundled.data('hwcrit', 1400)
+    assert image.array().tolist() == archived.data('hwcrit', 1400)[0].array().tolist()
+    region, regionDims = bundled.dataRegion('hwcrit', 1400, 10, 20, 5, 6)
+    assert regionDims == (5, 6)
+    assert region(0, 0) == image(10, 20)
+    bundled.close()
+    # Grids read before closing stay valid
+    assert image(10, 20) == region(0, 0)
+
+    # A bundle file can be used instead of a directory
+    with datasource.ArchivedRASPDataSource('/tmp/bundle-test/rasp.bundle') as bundled:
+        assert bundled.data('hwcrit', 1400)[0].array().tolist() == image.array().tolist()
+
+def test_help():
+    subprocess.check_call(['./raspbundle.py', '--help'])
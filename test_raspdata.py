@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import io
+
+import raspdata
+import raspgrid
+
+def test_gridReductions():
+    data = [[x * y - 20 for x in range(11)] for y in range(13)]
+    data[3][4] = -999999
+    data[5][6] = 999999
+    grid = raspgrid.RASPGrid(data)
+    dims = grid.dims()
+    assert raspdata.gridMinMax(grid) == raspdata.minMax(grid, dims)
+    assert raspdata.gridIntegral(grid) == raspdata.integral(grid, dims)
+    assert raspdata.gridArea(grid, lambda x: x >= 10) == raspdata.area(grid, dims, lambda x: x >= 10)
+
+def test_gridReductionsWithMask():
+    values = [[1.0, 2.0], [3.0, 4.0]]
+    valid = [[True, False], [True, True]]
+    assert raspdata.gridMinMax(values, valid) == (1.0, 4.0)
+    assert raspdata.gridIntegral(values, valid) == 8.0
+    assert raspdata.gridArea(values, lambda x: x > 2.0, valid) == 2.0 / 3.0
+
+def test_parseData():
+    rows = [[x * y - 7 for x in range(23)] for y in range(17)]
+    text = '---\nHollister RASP\nDay= 2018 11 26 MON ValidLST= 1400 PST Param= hwcrit Unit= ft\nProj= lambert dx= 4000.000 dy= 4000.000\n'
+    text += ''.join(' '.join(str(v) for v in row) + '\n' for row in rows)
+    for chunkSize in (5, 64, 2**16):
+        image, dims, header = raspdata.parseDataWithHeader(io.BytesIO(text.encode('ascii')), chunkSize)
+        assert dims == (23, 17)
+        assert image.array().tolist() == rows
+        assert header.title == 'Hollister RASP'
+        assert header.fields['ValidLST'] == '1400 PST'
+        assert header.fields['Param'] == 'hwcrit'
+        assert header.fields['dx'] == '4000.000'
+
+    image, dims = raspdata.parseData(io.BytesIO(text.encode('ascii')))
+    assert image(3, 4) == rows[4][3]
+
+    # A malformed value raises rather than being dropped
+    for chunkSize in (5, 2**16):
+        try:
+            raspdata.parseDataWithHeader(io.BytesIO(text.replace(' 5 ', ' 5x ', 1).encode('ascii')), chunkSize)
+            assert False
+        except ValueError:
+            pass
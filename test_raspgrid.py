@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import numpy
+import pytest
+
+import raspgrid
+
+def test_call():
+    dims = (11, 13)
+    grid = raspgrid.RASPGrid([[x * y for x in range(dims[0])] for y in range(dims[1])])
+    assert grid.dims() == dims
+    assert grid.width() == dims[0]
+    assert grid.height() == dims[1]
+    for y in range(dims[1]):
+        for x in range(dims[0]):
+            assert grid(x, y) == x * y
+            assert type(grid(x, y)) == int
+    with pytest.raises(ValueError):
+        grid(dims[0], 0)
+    with pytest.raises(ValueError):
+        grid(-1, 0)
+
+def test_validMask():
+    grid = raspgrid.RASPGrid([[1, -999999], [999999, 4]])
+    assert grid.validMask().tolist() == [[True, False], [False, True]]
+
+def test_slicing():
+    grid = raspgrid.RASPGrid(numpy.arange(20).reshape(4, 5))
+    sub = grid[1:3, 2:4]
+    assert sub.dims() == (2, 2)
+    assert sub(0, 0) == grid(1, 2)
+    assert sub(1, 1) == grid(2, 3)
+    assert grid[4, 3] == grid(4, 3)
+    assert grid.region(1, 2, 2, 2).array().tolist() == sub.array().tolist()
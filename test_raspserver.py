@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import time
+
+try:
+    from http.client import HTTPException
+    from urllib.error import HTTPError
+except ImportError:
+    from httplib import HTTPException
+    from urllib2 import HTTPError
+
+import datasource
+import httpcache
+import httpclient
+import raspbundle
+import raspgrid
+import raspserver
+
+def test_serve():
+    archived = datasource.ArchivedRASPDataSource('test-data')
+    with raspserver.RASPServer(['test-data']) as server:
+        web = datasource.WebRASPDataSource(server.url())
+        for day in (0, 3):
+            image, dims = web.data('hwcrit', day, 1400)
+            expected, expectedDims = archived.data('hwcrit', 1400)
+            assert dims == expectedDims
+            assert image.array().tolist() == expected.array().tolist()
+        try:
+            web.data('hwcrit', 0, 1300)
+            assert False
+        except HTTPError as err:
+            assert err.code == 404
+    assert server.stats['requests'] == 3
+    assert server.stats['notFound'] == 1
+
+def test_revalidate():
+    shutil.rmtree('/tmp/raspserver-test', ignore_errors=True)
+    cache = httpcache.HTTPGridCache('/tmp/raspserver-test')
+    with raspserver.RASPServer(['test-data']) as server:
+        for i in range(2):
+            datasource.WebRASPDataSource(server.url(), cache).data('wstar', 0, 1400)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert server.stats['notModified'] == 1
+
+def test_lastModified():
+    shutil.rmtree('/tmp/raspserver-test', ignore_errors=True)
+    shutil.copytree('test-data', '/tmp/raspserver-test/data')
+    source = '/tmp/raspserver-test/data/wstar.curr.1400lst.d2.data.pgz'
+    os.utime(source, (1000000000, 1000000000))
+    path = '/OUT+0/FCST/wstar.curr.1400lst.d2.data'
+    with raspserver.RASPServer(['/tmp/raspserver-test/data']) as server:
+        # The mtime of the file served, not of its directory
+        assert server.content(path)[1] == 1000000000
+        with open('/tmp/raspserver-test/data/new.txt', 'w') as file:
+            file.write('new')
+        assert server.content(path)[1] == 1000000000
+
+def test_precedence():
+    shutil.rmtree('/tmp/raspserver-test', ignore_errors=True)
+    os.makedirs('/tmp/raspserver-test')
+    raspbundle.writeBundle({('hwcrit', 1400): (raspgrid.RASPGrid([[1, 2]]), (2, 1))}, '/tmp/raspserver-test/rasp.bundle')
+    for (parameter, values) in (('hwcrit', '7 8'), ('wstar', '3 4')):
+        with open('/tmp/raspserver-test/{0}.curr.1400lst.d2.data'.format(parameter), 'w') as file:
+            file.write('---\ntitle\nparams1\nparams2\n{0}\n'.format(values))
+    os.utime('/tmp/raspserver-test/rasp.bundle', (1000000000, 1000000000))
+    archived = datasource.ArchivedRASPDataSource('/tmp/raspserver-test')
+    with raspserver.RASPServer(['/tmp/raspserver-test']) as server:
+        web = datasource.WebRASPDataSource(server.url())
+        # The bundle wins over a .data file, like in the data source, and a
+        # .data file is used for what the bundle does not have
+        for parameter in ('hwcrit', 'wstar'):
+            assert web.data(parameter, 0, 1400)[0].array().tolist() == archived.data(parameter, 1400)[0].array().tolist()
+        assert web.data('hwcrit', 0, 1400)[0].array().tolist() == [[1, 2]]
+        assert server.content('/OUT+0/FCST/hwcrit.curr.1400lst.d2.data')[1] == 1000000000
+        assert server.content('/OUT+0/FCST/wstar.curr.1400lst.d2.data')[0].startswith(b'---\ntitle')
+    archived.close()
+
+def test_faults():
+    client = httpclient.HTTPClient()
+    with raspserver.RASPServer(['test-data'], notFoundRate=1.0) as server:
+        try:
+            client.urlopen(server.url() + '/OUT+0/FCST/hwcrit.curr.1400lst.d2.data')
+            assert False
+        except HTTPError as err:
+            assert err.code == 404
+
+    with raspserver.RASPServer(['test-data'], resetRate=1.0) as server:
+        try:
+            datasource.WebRASPDataSource(server.url()).data('hwcrit', 0, 1400)
+            assert False
+        except (HTTPException, IOError, OSError):
+            pass
+    assert server.stats['resets'] >= 1
+
+def test_throttle():
+    # About 64kB at 256kB/s, after 0.1s
+    with raspserver.RASPServer(['test-data'], latency=0.1, bandwidth=256 * 1024) as server:
+        start = time.time()
+        datasource.WebRASPDataSource(server.url()).data('hwcrit', 0, 1400)
+        assert time.time() - start >= 0.3
+
+def test_help():
+    subprocess.check_call(['./raspserver.py', '--help'])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import datetime
+import io
+
+import numpy
+
+import rucsoundings
+
+# Two hours of a response from rucsoundings.noaa.gov
+SOUNDINGS = '''GFS analysis valid for grid point 9.5 nm / 296 deg from KCVH:
+GFS         21     26      Nov    2018
+   CAPE      0    CIN      0  Helic  99999     PW  99999
+      1  23062  99999  36.90 -121.56  99999  99999
+      2  99999  99999  99999     26  99999  99999
+      3           KCVH                   12     kt
+      9  10120     59    140     62    233      4
+      4  10000    158    132     59    246      6
+      4   8500   1530     30    -10    270     15
+      4   7000   3100    -55   -150    290     25
+
+GFS 1 hr forecast valid for grid point 9.5 nm / 296 deg from KCVH:
+GFS         22     26      Nov    2018
+   CAPE      0    CIN      0  Helic  99999     PW  99999
+      1  23062  99999  36.90 -121.56  99999  99999
+      2  99999  99999  99999     26  99999  99999
+      3           KCVH                   12     kt
+      9  10110     59    160     70    240      5
+      4  10000    150    150     65    250      7
+      4   8500   1525     40     -5    275     14
+      4   7000   3095    -50   -140    295     22
+'''
+
+def test_urlForSoundings():
+    url = rucsoundings.urlForSoundings('KCVH', 'GFS', datetime.datetime(2018, 11, 26, 21), datetime.datetime(2018, 11, 27, 0))
+    assert 'startSecs=1543266000' in url
+    assert 'endSecs=1543276800' in url
+    assert rucsoundings.urlForSounding('KCVH', 'GFS', datetime.datetime(2018, 11, 26, 21)) == rucsoundings.urlForSoundings('KCVH', 'GFS', datetime.datetime(2018, 11, 26, 21), datetime.datetime(2018, 11, 26, 22))
+
+def test_parseSoundings():
+    soundings = rucsoundings.parseSoundings(io.BytesIO(SOUNDINGS.encode('ascii')))
+    assert [validTime for (validTime, _) in soundings] == [datetime.datetime(2018, 11, 26, 21), datetime.datetime(2018, 11, 26, 22)]
+    for (_, sounding) in soundings:
+        assert len(sounding) == 4
+        assert sounding.surfaceNdx == 0
+    assert soundings[1][1].temperature[0] == 16.0
+    assert soundings[1][1].pressure[3] == 700.0
+    # The same as the line by line parser
+    levels, surfaceNdx = rucsoundings.parseSounding(io.StringIO(SOUNDINGS))
+    assert soundings[0][1] == rucsoundings.Sounding.fromLevels(levels, surfaceNdx)
+
+def test_parseSoundingsMissing():
+    text = SOUNDINGS.replace('      4   8500   1530     30    -10    270     15', '      4   8500   1530     30  99999    270     15')
+    text = text.replace('      4  10000    150    150     65    250      7', '      6  10000  99999  99999  99999    250      7')
+    soundings = rucsoundings.parseSoundings(io.StringIO(text))
+    assert numpy.isnan(soundings[0][1].dewpoint[2])
+    # A level without altitude is dropped
+    assert len(soundings[1][1]) == 3
+    assert soundings[1][1].surfaceNdx == 0
+
+    try:
+        rucsoundings.parseSoundings(io.StringIO(text.replace('   7000   3095', '   7000   30x5')))
+        assert False
+    except ValueError as err:
+        assert 'line 21' in str(err)
+
+def test_sounding():
+    levels, surfaceNdx = rucsoundings.parseSounding(io.StringIO(SOUNDINGS))
+    sounding = rucsoundings.Sounding.fromLevels(levels, surfaceNdx)
+    assert sounding.levels() == levels
+    assert rucsoundings.Sounding.fromJSON(sounding.toJSON()) == sounding
+
+    # Matches the per-level functions, which do not wrap wind direction
+    altitudes = [0.0, 59.0, 100.0, 158.0, 1000.0, 3000.0]
+    interpolated = sounding.interpolate(altitudes)
+    for (i, altitude) in enumerate(altitudes):
+        expected = rucsoundings.interpolateSounding(levels, altitude)
+        for key in expected:
+            if key == 'wind-direction':
+                assert abs(interpolated[key][i] - expected[key] % 360.0) < 1e-9
+            else:
+                assert abs(interpolated[key][i] - expected[key]) < 1e-9
+    assert rucsoundings.interpolateSounding(levels, 4000.0) == {}
+    assert sounding.interpolate(4000.0)['temperature'] != sounding.interpolate(4000.0)['temperature']
+
+    assert abs(sounding.freezingLevel() - rucsoundings.freezingLevel(levels)) < 1e-9
+    cloudbases = sounding.condenstationLevel([10.0, 20.0, 30.0])
+    for (temp, cloudbase) in zip([10.0, 20.0, 30.0], cloudbases):
+        assert abs(cloudbase - rucsoundings.condenstationLevel(levels, surfaceNdx, temp)) < 1e-9
+
+def test_windDirection():
+    sounding = rucsoundings.Sounding([1000, 900], [0, 1000], [10, 5], [0, 0], [350, 10], [5, 5])
+    assert abs(sounding.interpolate(250.0)['wind-direction'] - 355.0) < 1e-9
+    assert abs(sounding.interpolate(750.0)['wind-direction'] - 5.0) < 1e-9
+
+def test_standardAtmosphere():
+    pressures = numpy.linspace(5.0, 120.0, 10001)
+    T, h = rucsoundings.standardAtmosphere(pressures)
+    for i in range(0, len(pressures), 97):
+        expectedT, expectedH = rucsoundings.standardAtmosphere(float(pressures[i]))
+        assert abs(T[i] - expectedT) < 1e-9
+        assert abs(h[i] - expectedH) < 1e-6
+
+    for (minPressure, maxPressure) in ((10.0, 110.0), (40.0, 110.0), (10.0, 20.0)):
+        table = rucsoundings.StandardAtmosphereTable(minPressure, maxPressure, 256)
+        errorT, errorH = table.errorBound()
+        tableT, tableH = table(pressures)
+        # Away from the jump at the tropopause
+        near = numpy.abs(pressures - rucsoundings.TROPOPAUSE_KPA) < 1e-6
+        assert numpy.max(numpy.abs(tableT - T)[~near]) <= errorT + 1e-9
+        assert numpy.max(numpy.abs(tableH - h)[~near]) <= errorH + 1e-9
+        # Exact outside the table
+        outside = (pressures < minPressure) | (pressures > maxPressure)
+        assert numpy.array_equal(tableH[outside], h[outside])
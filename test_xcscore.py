@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
+import numpy
+
 import datasource
 import raspdata
+import raspgrid
 import xcscore
 
 def test_classifierFactory():
@@ -32,3 +35,151 @@ def test_classify():
         c, score = classifier.classify(dataSlice)
         assert type(c) == bool
         assert type(score) == float
+
+def test_requiredParameters():
+    for name in xcscore.XCClassifierFactory.allClassifierNames():
+        classifier = xcscore.XCClassifierFactory.classifier(name)
+        # Reading anything undeclared would raise
+        dataSlice = datasource.ArchivedRASPDataTimeSlice(
+            datasource.ArchivedRASPDataSource('test-data', declaredParameters=set(classifier.requiredParameters())),
+            1400
+        )
+        classifier.classify(dataSlice)
+
+# Bellman-Ford over every edge until nothing improves
+def bruteForceScore(a, b, width, height, hcrit, vvert):
+    scores = dict((node, float('inf')) for node in xcscore.allNodes(width, height))
+    scores[a] = 0.0
+    changed = True
+    while changed:
+        changed = False
+        for u in xcscore.allNodes(width, height):
+            for v in xcscore.neighbors(u, width, height):
+                alt = scores[u] + xcscore.score(u, v, hcrit, vvert, False)
+                if alt < scores[v] - 1e-12:
+                    scores[v] = alt
+                    changed = True
+    return scores[b]
+
+def randomGrids(width, height, seed):
+    state = numpy.random.RandomState(seed)
+    hcrit = raspgrid.RASPGrid(state.randint(2000, 11000, (height, width)))
+    vvert = raspgrid.RASPGrid(state.randint(-400, 600, (height, width)))
+    return hcrit, vvert
+
+def test_bestPath():
+    for seed in range(20):
+        width, height = 3 + seed % 5, 2 + seed % 7
+        hcrit, vvert = randomGrids(width, height, seed)
+        a = (0, 0)
+        b = (width - 1, height - 1)
+        expected = bruteForceScore(a, b, width, height, hcrit, vvert)
+        for aStar in (False, True):
+            path = xcscore.bestPath(a, b, width, height, hcrit, vvert, aStar)
+            assert path[0] == a and path[-1] == b
+            for (u, v) in zip(path[:-1], path[1:]):
+                assert v in xcscore.neighbors(u, width, height)
+            assert abs(xcscore.pathScore(path, hcrit, vvert) - expected) <= 1e-9 * expected
+
+def test_pathTree():
+    width, height = 6, 5
+    hcrit, vvert = randomGrids(width, height, 100)
+    tree = xcscore.PathTree((2, 1), width, height, hcrit, vvert)
+    assert tree.score((2, 1)) == 0.0
+    for b in xcscore.allNodes(width, height):
+        expected = bruteForceScore((2, 1), b, width, height, hcrit, vvert)
+        path = tree.path(b)
+        assert path[0] == (2, 1) and path[-1] == b
+        assert abs(tree.score(b) - expected) <= 1e-9 * max(expected, 1.0)
+        assert abs(xcscore.pathScore(path, hcrit, vvert) - tree.score(b)) <= 1e-9 * max(expected, 1.0)
+    assert tree.settledCount() == width * height
+
+def test_edgeCosts():
+    width, height = 5, 4
+    hcrit, vvert = randomGrids(width, height, 7)
+    edgeCosts = xcscore.EdgeCosts(width, height, hcrit, vvert)
+    topology = edgeCosts.topology
+    assert xcscore.gridTopology(width, height) is topology
+    for u in xcscore.allNodes(width, height):
+        i = topology.node(u)
+        edges = {}
+        for (offset, costs) in zip(topology.offsets, edgeCosts.costs):
+            if costs[i] != float('inf'):
+                edges[topology.coordinate(i + offset)] = costs[i]
+        assert set(edges.keys()) == xcscore.neighbors(u, width, height)
+        for v in edges:
+            expected = xcscore.score(u, v, hcrit, vvert, False)
+            assert abs(edges[v] - expected) <= 1e-12 * expected
+
+def test_windowedBestPath(monkeypatch):
+    for seed in range(10):
+        width, height = 12, 10
+        hcrit, vvert = randomGrids(width, height, 200 + seed)
+        a = (3, 3)
+        b = (7, 6)
+        expected = bruteForceScore(a, b, width, height, hcrit, vvert)
+        for margin in (0, 1, 3):
+            path = xcscore.bestPath(a, b, width, height, hcrit, vvert, margin=margin)
+            assert path[0] == a and path[-1] == b
+            assert abs(xcscore.pathScore(path, hcrit, vvert) - expected) <= 1e-9 * expected
+
+    # Strong lift only along the edge of the grid, far outside the box
+    width, height = 20, 20
+    hcrit = raspgrid.RASPGrid(numpy.full((height, width), 3000))
+    vvert = raspgrid.RASPGrid(numpy.full((height, width), -500))
+    lift = vvert.array().copy()
+    lift[0, :] = 2000
+    lift[:, 0] = 2000
+    lift[:, 19] = 2000
+    vvert = raspgrid.RASPGrid(lift)
+    a = (0, 10)
+    b = (19, 10)
+    assert xcscore.windowedBestPath(a, b, width, height, hcrit, vvert, 2) is None
+    # The path leaves every box tried, and the bound is worked out once
+    ratios = []
+    minimumScoreRatio = xcscore.minimumScoreRatio
+    monkeypatch.setattr(xcscore, 'minimumScoreRatio', lambda *args: ratios.append(args) or minimumScoreRatio(*args))
+    path = xcscore.bestPath(a, b, width, height, hcrit, vvert, margin=2)
+    assert (10, 0) in path
+    assert abs(xcscore.pathScore(path, hcrit, vvert) - bruteForceScore(a, b, width, height, hcrit, vvert)) < 1e-9
+    assert len(ratios) == 1
+
+    # An invalid value far away makes the bound 0, so no box is tried
+    lift[19, 19] = 999999
+    vvert = raspgrid.RASPGrid(lift)
+    assert minimumScoreRatio(hcrit, vvert) == 0.0
+    windows = []
+    windowedBestPath = xcscore.windowedBestPath
+    monkeypatch.setattr(xcscore, 'windowedBestPath', lambda *args: windows.append(args) or windowedBestPath(*args))
+    a = (5, 10)
+    b = (8, 10)
+    path = xcscore.bestPath(a, b, width, height, hcrit, vvert, margin=2)
+    assert windows == []
+    assert path[0] == a and path[-1] == b
+    expected = bruteForceScore(a, b, width, height, hcrit, vvert)
+    assert abs(xcscore.pathScore(path, hcrit, vvert) - expected) <= 1e-9 * expected
+
+def test_unreachable():
+    # Missing data makes every edge of (5, 5) overflow to an infinite score
+    width, height = 10, 10
+    hcrit = raspgrid.RASPGrid(numpy.full((height, width), 6000))
+    lift = numpy.zeros((height, width))
+    lift[5, 5] = -999999
+    vvert = raspgrid.RASPGrid(lift)
+    for aStar in (False, True):
+        for margin in (None, 2):
+            try:
+                xcscore.bestPath((0, 0), (5, 5), width, height, hcrit, vvert, aStar, margin=margin)
+                assert False
+            except ValueError:
+                pass
+            # Paths go around it
+            path = xcscore.bestPath((0, 0), (9, 9), width, height, hcrit, vvert, aStar, margin=margin)
+            assert (5, 5) not in path and all(0 <= x < width and 0 <= y < height for (x, y) in path)
+    tree = xcscore.PathTree((0, 0), width, height, hcrit, vvert)
+    for method in (tree.score, tree.path):
+        try:
+            method((5, 5))
+            assert False
+        except ValueError:
+            pass
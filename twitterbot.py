@@ -27,6 +27,7 @@ import threading
 import time
 import tweepy
 from builtins import range, str
+from contextlib import closing
 from io import open
 
 try:
@@ -39,6 +40,9 @@ except ImportError:
     from urllib2 import urlopen, Request, HTTPError
 
 import datasource
+import gridcache
+import httpcache
+import httpclient
 import raspdata
 import utilities
 
@@ -46,12 +50,14 @@ import localscore
 import wavescore
 import xcscore
 
+# Number of files to download at once
+FETCH_WORKERS = 8
 
 # Download the file with the specified url to the given path
 def download(url, path):
     try:
-        response = urlopen(url)
-        data = response.read()
+        with closing(httpclient.urlopen(url)) as response:
+            data = response.read()
     except (KeyboardInterrupt, SystemExit):
         raise
     except:
@@ -122,12 +128,18 @@ def daysString(dates):
         first = False
     return ret
 
+# Download everything the classifier declares it needs for these days and
+# times in parallel, rather than one file at a time as it classifies
+def prefetch(classifier, dataSource, days, times):
+    dataSource.prefetch([(parameter, day, time) for parameter in classifier.requiredParameters() for day in days for time in times], FETCH_WORKERS)
+
 # Returns a set of good wave days and an image URL
-def goodWaveDays(classifier, baseURL, times, lookahead, skipDates):
+def goodWaveDays(classifier, baseURL, times, lookahead, skipDates, httpCache=None, memoryCache=None):
     waveDays = set()
     maxWaveScore = -1000.0
     waveImageURL = None
-    dataSource = datasource.WebRASPDataSource(baseURL)
+    dataSource = datasource.WebRASPDataSource(baseURL, httpCache, datasource.declaredParameters(classifier), memoryCache)
+    prefetch(classifier, dataSource, [day for day in range(lookahead) if datetime.date.today() + datetime.timedelta(day) not in skipDates], times)
     for day in range(lookahead):
         date = datetime.date.today() + datetime.timedelta(day)
         if date in skipDates:
@@ -156,9 +168,10 @@ def goodWaveDays(classifier, baseURL, times, lookahead, skipDates):
     return waveDays, waveImageURL
 
 # Detect XC days
-def goodXCDays(classifier, baseURL, times, lookahead, skipDates):
+def goodXCDays(classifier, baseURL, times, lookahead, skipDates, httpCache=None, memoryCache=None):
     xcDays = set()
-    dataSource = datasource.WebRASPDataSource(baseURL)
+    dataSource = datasource.WebRASPDataSource(baseURL, httpCache, datasource.declaredParameters(classifier), memoryCache)
+    prefetch(classifier, dataSource, [day for day in range(lookahead) if datetime.date.today() + datetime.timedelta(day) not in skipDates], times)
     maxScore = -1000.0
     bestTimeSlice = None
     for day in range(lookahead):
@@ -189,9 +202,10 @@ def goodXCDays(classifier, baseURL, times, lookahead, skipDates):
     return (xcDays, classifier.imageSummary(bestTimeSlice))
 
 # Detect local soaring days
-def goodLocalDays(classifier, baseURL, times, lookahead, skipDates):
+def goodLocalDays(classifier, baseURL, times, lookahead, skipDates, httpCache=None, memoryCache=None):
     localDays = set()
-    dataSource = datasource.WebRASPDataSource(baseURL)
+    dataSource = datasource.WebRASPDataSource(baseURL, httpCache, datasource.declaredParameters(classifier), memoryCache)
+    prefetch(classifier, dataSource, [day for day in range(lookahead) if datetime.date.today() + datetime.timedelta(day) not in skipDates], times)
     maxScore = -1000.0
     bestTimeSlice = None
     for day in range(lookahead):
@@ -271,6 +285,9 @@ if __name__=='__main__':
     parser.add_argument('--local-classifier', type=str, default='KCVH', metavar='name', help='Name of the local classifier or None')
     parser.add_argument('--wave-classifier', type=str, default='KCVH', metavar='name', help='Name of the wave classifier or None')
     parser.add_argument('--xc-classifier', type=str, default='KCVH', metavar='name', help='Name of the XC classifier or None')
+    parser.add_argument('--http-cache', type=str, default='.http-cache', metavar='path', help='Directory in which to cache RASP data between runs, or an empty string for no cache')
+    parser.add_argument('--http-cache-size', type=int, default=256, metavar='MB', help='Size limit of the HTTP cache')
+    parser.add_argument('--memory-cache-size', type=int, default=256, metavar='MB', help='Size limit of the parsed RASP data kept in memory')
     args = parser.parse_args()
 
     # Set up logging
@@ -300,31 +317,43 @@ if __name__=='__main__':
             tweetThreads.append(tweetThread)
             tweetThread.start()
 
+    # Keep one connection open for each download thread
+    httpclient.setSharedClient(httpclient.HTTPClient(FETCH_WORKERS))
+    httpCache = None
+    if args.http_cache:
+        httpCache = httpcache.HTTPGridCache(args.http_cache, args.http_cache_size * 2**20)
+    # Shared by all classifiers, since some read the same data
+    memoryCache = gridcache.GridMemoryCache(args.memory_cache_size * 2**20)
+
     localClassifier = localscore.LocalClassifierFactory.classifier(args.local_classifier)
     waveClassifier = wavescore.WaveClassifierFactory.classifier(args.wave_classifier)
     xcClassifier = xcscore.XCClassifierFactory.classifier(args.xc_classifier)
 
     # Run local soaring day detection
     if localClassifier:
-        (localDays, localImageURL) = goodLocalDays(localClassifier, args.local_url, args.local_times, args.local_lookahead, state['local-days'])
+        (localDays, localImageURL) = goodLocalDays(localClassifier, args.local_url, args.local_times, args.local_lookahead, state['local-days'], httpCache, memoryCache)
         # Add dates to the set of dates we already notified on
         state['local-days'] |= localDays
         tweetAlert('Local Soaring Alert! These days may be good for local soaring: ', localDays, localImageURL, args.local_url)
 
     # Run wave day detection
     if waveClassifier:
-        (waveDays, waveImageURL) = goodWaveDays(waveClassifier, args.wave_url, args.wave_times, args.wave_lookahead, state['wave-days'])
+        (waveDays, waveImageURL) = goodWaveDays(waveClassifier, args.wave_url, args.wave_times, args.wave_lookahead, state['wave-days'], httpCache, memoryCache)
         # Add dates to the set of dates we already notified on
         state['wave-days'] |= waveDays
         tweetAlert('Wave Alert! These days may have wave: ', waveDays, waveImageURL, args.wave_url)
 
     # Run XC day detection
     if xcClassifier:
-        (xcDays, xcImageURL) = goodXCDays(xcClassifier, args.xc_url, args.xc_times, args.xc_lookahead, state['xc-days'])
+        (xcDays, xcImageURL) = goodXCDays(xcClassifier, args.xc_url, args.xc_times, args.xc_lookahead, state['xc-days'], httpCache, memoryCache)
         # Add dates to the set of dates we already notified on
         state['xc-days'] |= xcDays
         tweetAlert('XC Alert! These days may be runnable: ', xcDays, xcImageURL, args.xc_url)
 
+    if httpCache:
+        httpCache.logStats()
+    memoryCache.logStats()
+
     # Write state back
     writeState(state, '.state.json')
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import os
 import random
 import string
 
@@ -7,3 +8,67 @@ import string
 def randomString(length):
     letters = string.ascii_lowercase
     return ''.join(random.choice(letters) for i in range(length))
+
+# Keeps the total size of the files in 'directory' ending in 'suffix', so
+# that a cache can tell whether it is over maxBytes without listing the
+# directory. It is scanned once here, then again only when over the limit,
+# to evict. Not thread safe; callers hold their own lock.
+class DirectorySizeLimit:
+    def __init__(self, directory, suffix, maxBytes):
+        self.__directory = directory
+        self.__suffix = suffix
+        self.__maxBytes = maxBytes
+        self.__rescan()
+
+    # (mtime, size, filename) of the files
+    def __scan(self):
+        files = []
+        for name in os.listdir(self.__directory):
+            if not name.endswith(self.__suffix):
+                continue
+            filename = os.path.join(self.__directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+        return files
+
+    def __rescan(self):
+        files = self.__scan()
+        self.__sizes = dict((filename, size) for (_, size, filename) in files)
+        self.__total = sum(self.__sizes.values())
+        return files
+
+    # Total bytes of the files
+    def total(self):
+        return self.__total
+
+    # Count 'filename', which was just written, and remove the files with
+    # the oldest mtime while the total is over maxBytes. Returns the number
+    # of files removed.
+    def written(self, filename):
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            # Removed already by another thread or process
+            self.__total -= self.__sizes.pop(filename, 0)
+            return 0
+        self.__total += size - self.__sizes.get(filename, 0)
+        self.__sizes[filename] = size
+        if self.__total <= self.__maxBytes:
+            return 0
+        # Other processes may share the directory, so evict from what is
+        # really there
+        ret = 0
+        for (_, size, filename) in sorted(self.__rescan()):
+            if self.__total <= self.__maxBytes:
+                break
+            try:
+                os.remove(filename)
+                ret += 1
+            except OSError:
+                pass
+            self.__total -= size
+            del self.__sizes[filename]
+        return ret
@@ -23,16 +23,21 @@ import os
 from builtins import zip
 from io import open
 
+import gridcache
 import raspdata
 
 class AbstractWaveClassifier:
+    # List of every RASP parameter that feature() and imageSummary() read
+    def requiredParameters(self):
+        raise NotImplementedError()
+
     def feature(self, raspDataTimeSlice):
         raise NotImplementedError()
 
     def classify(self, raspDataTimeSlice):
         raise NotImplementedError()
 
-class KCVHWaveClassifier:
+class KCVHWaveClassifier(AbstractWaveClassifier):
     def __init__(self):
         self.weight = [0.16068532, 1.94050705, -0.4090309]
         self.bias = -1.8543847882
@@ -46,9 +51,11 @@ class KCVHWaveClassifier:
         if 'WEATHERBOT_WAVE_THRESHOLD' in os.environ:
             self.threshold = float(os.environ['WEATHERBOT_WAVE_THRESHOLD'])
 
+    def requiredParameters(self):
+        return ['press700', 'press850', 'sfcsunpct']
+
     def feature(self, raspDataTimeSlice):
-        (data500mb, dims) = raspDataTimeSlice.data('press500')
-        (data700mb, _) = raspDataTimeSlice.data('press700')
+        (data700mb, dims) = raspDataTimeSlice.data('press700')
         (data850mb, _) = raspDataTimeSlice.data('press850')
         (dataSfcSun, _) = raspDataTimeSlice.data('sfcsunpct')
         # NOTE: I would rather just add a separate feature for cloud cover,
@@ -58,21 +65,15 @@ class KCVHWaveClassifier:
         # feature derived from this should be inhibitory only, because
         # being sunny does not 'help' a wave day. So, the feature should be at
         # most 0.0 on a sunny day.
-        cloudCoverArea = raspdata.area(dataSfcSun, dims, lambda x: x <= 80)
-        def cloudCoverFactor(x,y):
-            return 1.0 - pow(cloudCoverArea, 2.0)
-            #totalCloudCover = 1.0 - min(1.0, max(0.0, dataSfcSun(x, y) / 100.0))
-            #return 1.0 - pow(totalCloudCover, 4.0)
-        def usableLift500(x,y):
-            return data500mb(x,y) * cloudCoverFactor(x,y)
-        def usableLift700(x,y):
-            return data700mb(x,y) * cloudCoverFactor(x,y)
-        def usableLift850(x,y):
-            return data850mb(x,y) * cloudCoverFactor(x,y)
-
-        liftArea500 = raspdata.area(usableLift500, dims, lambda x: x >= 150)
-        liftArea700 = raspdata.area(usableLift700, dims, lambda x: x >= 150)
-        liftArea850 = raspdata.area(usableLift850, dims, lambda x: x >= 150)
+        cloudCoverArea = raspdata.gridArea(dataSfcSun, lambda x: x <= 80)
+        cloudCoverFactor = 1.0 - pow(cloudCoverArea, 2.0)
+        #totalCloudCover = 1.0 - numpy.clip(dataSfcSun.array() / 100.0, 0.0, 1.0)
+        #cloudCoverFactor = 1.0 - numpy.power(totalCloudCover, 4.0)
+        usableLift700 = data700mb.array() * cloudCoverFactor
+        usableLift850 = data850mb.array() * cloudCoverFactor
+
+        liftArea700 = raspdata.gridArea(usableLift700, lambda x: x >= 150)
+        liftArea850 = raspdata.gridArea(usableLift850, lambda x: x >= 150)
 
         # NOTE: for numerical stability, it is important that the features be
         # roughly centered and of the same magnitude
@@ -109,8 +110,14 @@ if __name__=='__main__':
     parser = argparse.ArgumentParser(description='Learn good wave days from a dataset')
     parser.add_argument('-i', '--dataset', type=str, default='data/kcvh-wave.json', metavar='path', help='Dataset json file')
     parser.add_argument('-c', '--classifier', type=str, default='KCVH', metavar='name', help='Name of the classifier')
+    parser.add_argument('--grid-cache', type=str, metavar='path', help='Directory in which to cache decoded grids between runs')
+    parser.add_argument('--grid-cache-size', type=int, default=1024, metavar='MB', help='Size limit of the grid cache')
     args = parser.parse_args()
 
+    gridCache = None
+    if args.grid_cache:
+        gridCache = gridcache.GridFileCache(args.grid_cache, args.grid_cache_size * 2**20)
+
     positives = []
     negatives = []
     with open(args.dataset) as file:
@@ -119,7 +126,7 @@ if __name__=='__main__':
         negatives = dataset['negative']
 
     classifier = WaveClassifierFactory.classifier(args.classifier)
-    (features, labels) = raspdata.featuresAndLabelsFromDataset(positives, negatives, classifier)
+    (features, labels) = raspdata.featuresAndLabelsFromDataset(positives, negatives, classifier, gridCache)
 
     (fMin, fMax, fMean, fStd) = raspdata.featureStats(features)
     print('Feature min: {0}'.format(fMin))
@@ -127,13 +134,16 @@ if __name__=='__main__':
     print('Feature mean: {0}'.format(fMean))
     print('Feature std: {0}'.format(fStd))
 
-    raspdata.evaluateDataset(positives, negatives, classifier)
+    raspdata.evaluateDataset(positives, negatives, classifier, gridCache)
     print('Weight: {0}'.format(classifier.weight))
     print('Bias: {0}'.format(classifier.bias))
     print('\n\n')
 
     (classifier.weight, classifier.bias) = raspdata.learn(features, labels)
 
-    raspdata.evaluateDataset(positives, negatives, classifier)
+    raspdata.evaluateDataset(positives, negatives, classifier, gridCache)
     print('Weight: {0}'.format(classifier.weight))
     print('Bias: {0}'.format(classifier.bias))
+
+    if gridCache:
+        print('Grid cache: {0} hits, {1} misses, {2} evictions'.format(gridCache.hits, gridCache.misses, gridCache.evictions))
@@ -18,16 +18,19 @@
 # along with GliderWeatherBot.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import heapq
 import itertools
 import json
 import math
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
+import numpy
 import os
 from builtins import range, zip
 from io import open
 
+import gridcache
 import raspdata
 import utilities
 
@@ -36,6 +39,9 @@ import utilities
 RELEASE_RANCH = (19, 80)
 BLACK_MOUNTAIN = (24, 56)
 
+# Cells around the endpoints to search first for the XC path
+SEARCH_MARGIN = 16
+
 # The score must represent "distance" between nodes such that bigger distance
 # is worse than smaller distance.
 # The score must be nonnegative and symmetric. I.e.
@@ -73,42 +79,295 @@ def neighbors(u, width, height):
 def allNodes(width, height):
     return itertools.product(range(width), range(height))
 
-# Use Dijkstra's algorithm to find the best path from 'a' to 'b'
-def bestPath(a, b, width, height, hcrit, vvert):
-    nodes = allNodes(width, height)
-    scoreFromA = {}
-    prev = {}
-    pushed = {}
-    for node in nodes:
-        scoreFromA[node] = float('inf')
-        pushed[node] = False
-    scoreFromA[a] = 0
-
-    nodeQueue = [a]
-    pushed[a] = True
+# Equivalent lift of each cell, as an array indexed [y, x]. score() uses
+# the average of this over the two ends of an edge.
+def equivalentLift(hcrit, vvert):
+    return vvert.array() + (hcrit.array() - 6000.0) / 2000.0 * 200.0
+
+# A lower bound on score(u, v) / dist(u, v) over the whole grid
+def minimumScoreRatio(hcrit, vvert):
+    return math.exp(-float(numpy.max(equivalentLift(hcrit, vvert))) / 500.0)
+
+# Length of the shortest 8-connected path from u to v on an empty grid
+def octileDistance(u, v):
+    dx = abs(u[0] - v[0])
+    dy = abs(u[1] - v[1])
+    return max(dx, dy) + (math.sqrt(2.0) - 1.0) * min(dx, dy)
+
+# Sum of score() along a path
+def pathScore(path, hcrit, vvert):
+    return sum(score(u, v, hcrit, vvert, False) for (u, v) in zip(path[:-1], path[1:]))
+
+# The (dx, dy) of the eight neighbors
+DIRECTIONS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+# The graph of a width x height grid, the same for every time slice. Nodes
+# are numbered y * width + x like the flattened data arrays, so the neighbor
+# in direction d of node i is i + offsets[d] when inside[d][i] is True.
+class GridTopology:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.offsets = [dy * width + dx for (dx, dy) in DIRECTIONS]
+        self.distances = [math.sqrt(dx * dx + dy * dy) for (dx, dy) in DIRECTIONS]
+        x = numpy.arange(width)[numpy.newaxis, :]
+        y = numpy.arange(height)[:, numpy.newaxis]
+        self.inside = [((x + dx >= 0) & (x + dx < width) & (y + dy >= 0) & (y + dy < height)).ravel() for (dx, dy) in DIRECTIONS]
+        # The same as lists, for the search loops
+        self.insideLists = [inside.tolist() for inside in self.inside]
+
+    def node(self, u):
+        if not (0 <= u[0] < self.width and 0 <= u[1] < self.height):
+            raise ValueError('{0} is not in the {1}x{2} grid'.format(u, self.width, self.height))
+        return u[1] * self.width + u[0]
+
+    def coordinate(self, i):
+        return (i % self.width, i // self.width)
+
+_topologies = {}
+
+# The GridTopology of a grid size, built once
+def gridTopology(width, height):
+    if (width, height) not in _topologies:
+        _topologies[(width, height)] = GridTopology(width, height)
+    return _topologies[(width, height)]
+
+# score() of every edge of a time slice, computed at once. costs[d][i] is
+# the score of the edge from node i in direction d, or infinity if that
+# leaves the grid. These are plain lists, which the search loops read
+# faster than arrays. A huge negative lift, like -999999 for missing data,
+# also overflows to infinity, so whether an edge exists is read from
+# topology.inside, and an infinite score makes the edge impassable.
+class EdgeCosts:
+    def __init__(self, width, height, hcrit, vvert):
+        self.topology = gridTopology(width, height)
+        lift = equivalentLift(hcrit, vvert).ravel()
+        self.maxLift = float(numpy.max(lift))
+        self.costs = []
+        for (offset, distance, inside) in zip(self.topology.offsets, self.topology.distances, self.topology.inside):
+            # Wrapped values only land where 'inside' is False
+            neighborLift = numpy.roll(lift, -offset)
+            with numpy.errstate(over='ignore'):
+                cost = numpy.exp(-(lift + neighborLift) / 2.0 / 500.0) * distance
+            cost[~inside] = float('inf')
+            self.costs.append(cost.tolist())
+
+    # A lower bound on the score per unit distance of any edge
+    def minimumScoreRatio(self):
+        return math.exp(-self.maxLift / 500.0)
+
+# Shortest paths from 'a' to any number of destinations with one run of
+# Dijkstra's algorithm. The search is resumed only as far as each query
+# needs, so destinations near 'a' are cheap, and no node is settled twice.
+# 'edgeCosts' may be given to share one EdgeCosts between searches.
+class PathTree:
+    def __init__(self, a, width, height, hcrit, vvert, edgeCosts=None):
+        self.__edgeCosts = edgeCosts or EdgeCosts(width, height, hcrit, vvert)
+        topology = self.__edgeCosts.topology
+        self.__a = topology.node(a)
+        size = width * height
+        self.__scoreFromA = [float('inf')] * size
+        self.__scoreFromA[self.__a] = 0.0
+        self.__prev = [-1] * size
+        self.__settled = bytearray(size)
+        self.__settledCount = 0
+        self.__nodeQueue = [(0.0, self.__a)]
+
+    # Settle nodes until 'b' is settled or the next would score maxScore or
+    # more. b = -1 for no target.
+    def __settle(self, b, maxScore=float('inf')):
+        settled = self.__settled
+        if b >= 0 and settled[b]:
+            return
+        scoreFromA = self.__scoreFromA
+        prev = self.__prev
+        nodeQueue = self.__nodeQueue
+        topology = self.__edgeCosts.topology
+        directions = list(zip(topology.offsets, self.__edgeCosts.costs, topology.insideLists))
+        while len(nodeQueue) > 0:
+            if nodeQueue[0][0] >= maxScore:
+                return
+            scoreU, u = heapq.heappop(nodeQueue)
+            if settled[u]:
+                continue
+            settled[u] = 1
+            self.__settledCount += 1
+            for (offset, costs, inside) in directions:
+                v = u + offset
+                if not inside[u] or settled[v]:
+                    continue
+                altScore = scoreU + costs[u]
+                if altScore < scoreFromA[v]:
+                    scoreFromA[v] = altScore
+                    prev[v] = u
+                    heapq.heappush(nodeQueue, (altScore, v))
+            if u == b:
+                return
+
+    # Number of nodes whose best score is known so far
+    def settledCount(self):
+        return self.__settledCount
+
+    # Settle every node that scores less than maxScore
+    def settleBelow(self, maxScore):
+        self.__settle(-1, maxScore)
+
+    # The best score to 'b' if it is settled, else None
+    def settledScore(self, b):
+        b = self.__edgeCosts.topology.node(b)
+        return self.__scoreFromA[b] if self.__settled[b] else None
+
+    # Settle 'b' and return its node, or raise ValueError if it cannot be
+    # reached from 'a'
+    def __settledNode(self, b):
+        topology = self.__edgeCosts.topology
+        node = topology.node(b)
+        self.__settle(node)
+        if not self.__settled[node]:
+            raise ValueError('{0} is not reachable from {1} in a {2}x{3} grid'.format(b, topology.coordinate(self.__a), topology.width, topology.height))
+        return node
+
+    # Best score from 'a' to 'b'
+    def score(self, b):
+        return self.__scoreFromA[self.__settledNode(b)]
+
+    # Best path from 'a' to 'b', both included
+    def path(self, b):
+        topology = self.__edgeCosts.topology
+        node = self.__settledNode(b)
+        reversedPath = [node]
+        while reversedPath[-1] != self.__a:
+            reversedPath.append(self.__prev[reversedPath[-1]])
+        return [topology.coordinate(x) for x in reversed(reversedPath)]
+
+# Best path from 'a' to 'b' searching only the box around them grown by
+# 'margin' cells, or None if that cannot be shown to be the best path in the
+# whole grid. A path that leaves the box does so first from some cell w on
+# the edge of the box. Its part up to w stays inside the box, so the whole
+# path scores at least
+#   (score from 'a' to w inside the box) + minimumScoreRatio() * octileDistance(w, b)
+# If the path in the box touches the edge, or one of these bounds is less
+# than its score, the answer is None. 'ratio' is minimumScoreRatio(), which
+# callers trying several boxes on one slice can work out once.
+def windowedBestPath(a, b, width, height, hcrit, vvert, margin, ratio=None):
+    x0 = max(0, min(a[0], b[0]) - margin)
+    y0 = max(0, min(a[1], b[1]) - margin)
+    x1 = min(width, max(a[0], b[0]) + margin + 1)
+    y1 = min(height, max(a[1], b[1]) + margin + 1)
+    windowWidth = x1 - x0
+    windowHeight = y1 - y0
+    windowHcrit = hcrit.region(x0, y0, windowWidth, windowHeight)
+    windowVvert = vvert.region(x0, y0, windowWidth, windowHeight)
+    tree = PathTree((a[0] - x0, a[1] - y0), windowWidth, windowHeight, windowHcrit, windowVvert)
+    windowB = (b[0] - x0, b[1] - y0)
+    try:
+        pathScore = tree.score(windowB)
+    except ValueError:
+        # Cut off inside the box, but maybe not in the whole grid
+        return None
+    path = [(x + x0, y + y0) for (x, y) in tree.path(windowB)]
+
+    # Cells of the box with neighbors outside it
+    edge = set()
+    for x in range(x0, x1):
+        if y0 > 0:
+            edge.add((x, y0))
+        if y1 < height:
+            edge.add((x, y1 - 1))
+    for y in range(y0, y1):
+        if x0 > 0:
+            edge.add((x0, y))
+        if x1 < width:
+            edge.add((x1 - 1, y))
+    if any(u in edge for u in path):
+        return None
+
+    # Anything unsettled scores at least pathScore already
+    tree.settleBelow(pathScore)
+    if ratio is None:
+        ratio = minimumScoreRatio(hcrit, vvert)
+    ratio *= 1.0 - 1e-9
+    for w in edge:
+        scoreToW = tree.settledScore((w[0] - x0, w[1] - y0))
+        if scoreToW is not None and scoreToW + ratio * octileDistance(w, b) < pathScore:
+            return None
+    return path
+
+# Find the best path from 'a' to 'b' with Dijkstra's algorithm, which stops
+# once 'b' is settled. Use a PathTree for many paths from 'a'. With aStar,
+# nodes are explored in order of their score plus a lower bound on the score
+# left to 'b', the octile distance times the smallest score per unit
+# distance, which usually settles far fewer nodes and finds a path with the
+# same score.
+#
+# With a margin, the search is first tried in a box around 'a' and 'b' with
+# windowedBestPath(), doubling the margin until that gives the answer or the
+# box is the whole grid. The path scores the same as the full search. Lift
+# of 999999 anywhere, like an invalid value, makes minimumScoreRatio() 0, so
+# the bounds are only the scores to the edge of the box. They almost never
+# show the box is enough, so the full search is done straight away.
+def bestPath(a, b, width, height, hcrit, vvert, aStar=False, edgeCosts=None, margin=None):
+    if margin is not None and edgeCosts is None:
+        windowRatio = minimumScoreRatio(hcrit, vvert)
+        if windowRatio == 0.0:
+            margin = None
+    while margin is not None and edgeCosts is None:
+        if max(a[0], b[0]) - min(a[0], b[0]) + 2 * margin + 1 >= width and max(a[1], b[1]) - min(a[1], b[1]) + 2 * margin + 1 >= height:
+            break
+        path = windowedBestPath(a, b, width, height, hcrit, vvert, margin, windowRatio)
+        if path is not None:
+            return path
+        margin = max(1, 2 * margin)
+
+    edgeCosts = edgeCosts or EdgeCosts(width, height, hcrit, vvert)
+    if not aStar:
+        return PathTree(a, width, height, hcrit, vvert, edgeCosts).path(b)
+
+    topology = edgeCosts.topology
+    start = topology.node(a)
+    target = topology.node(b)
+    # Shrunk a little so that rounding cannot make it overestimate
+    ratio = edgeCosts.minimumScoreRatio() * (1.0 - 1e-9)
+    diagonal = math.sqrt(2.0) - 1.0
+    def heuristic(i):
+        dx = abs(i % width - b[0])
+        dy = abs(i // width - b[1])
+        return ratio * (max(dx, dy) + diagonal * min(dx, dy))
+
+    size = width * height
+    scoreFromA = [float('inf')] * size
+    scoreFromA[start] = 0.0
+    prev = [-1] * size
+    settled = bytearray(size)
+    directions = list(zip(topology.offsets, edgeCosts.costs, topology.insideLists))
+    nodeQueue = [(heuristic(start), 0.0, start)]
     while len(nodeQueue) > 0:
-        u = nodeQueue[0]
-        nodeQueue.pop(0)
-        #print('u: {0}'.format(u))
-        for v in neighbors(u, width, height):
-            if not pushed[v]:
-                nodeQueue.append(v)
-                pushed[v] = True
-
-            altScore = scoreFromA[u] + score(u, v, hcrit, vvert, False)
+        _, scoreU, u = heapq.heappop(nodeQueue)
+        if settled[u]:
+            continue
+        settled[u] = 1
+        if u == target:
+            break
+        for (offset, costs, inside) in directions:
+            v = u + offset
+            if not inside[u] or settled[v]:
+                continue
+            altScore = scoreU + costs[u]
             if altScore < scoreFromA[v]:
                 scoreFromA[v] = altScore
                 prev[v] = u
-    # TODO: reuse everything computed so far for any endpoint
-    reversedPath = [b]
-    while reversedPath[-1] != a:
-        #score(reversedPath[-1], prev[reversedPath[-1]], hcrit, vvert, True)
+                heapq.heappush(nodeQueue, (altScore + heuristic(v), altScore, v))
+    if not settled[target]:
+        raise ValueError('{0} is not reachable from {1} in a {2}x{3} grid'.format(b, a, width, height))
+    reversedPath = [target]
+    while reversedPath[-1] != start:
         reversedPath.append(prev[reversedPath[-1]])
-    #print('Score: {0}'.format(scoreFromA[b]))
-    #print('Path: {0}'.format([x for x in reversed(reversedPath)]))
-    return [x for x in reversed(reversedPath)]
+    return [topology.coordinate(x) for x in reversed(reversedPath)]
 
 class AbstractXCClassifier:
+    # List of every RASP parameter that feature() and imageSummary() read
+    def requiredParameters(self):
+        raise NotImplementedError()
     def feature(self, startCoordinate, endCoordinate, raspDataTimeSlice):
         raise NotImplementedError()
     def classify(self, startCoordinate, endCoordinate, raspDataTimeSlice):
@@ -127,6 +386,9 @@ class KCVHXCClassifier(AbstractXCClassifier):
         if 'WEATHERBOT_XC_THRESHOLD' in os.environ:
             self.threshold = float(os.environ['WEATHERBOT_XC_THRESHOLD'])
 
+    def requiredParameters(self):
+        return ['hwcrit', 'wblmaxmin']
+
     def imageSummary(self, raspDataTimeSlice):
         ret = '/tmp/{0}.png'.format(utilities.randomString(8))
 
@@ -138,7 +400,7 @@ class KCVHXCClassifier(AbstractXCClassifier):
         except:
             return None
 
-        path = bestPath(RELEASE_RANCH, BLACK_MOUNTAIN, dims[0], dims[1], dataHcrit, wblmaxmin)
+        path = bestPath(RELEASE_RANCH, BLACK_MOUNTAIN, dims[0], dims[1], dataHcrit, wblmaxmin, aStar=True, margin=SEARCH_MARGIN)
         # Flip the path upside down
         path = [(x, dims[1] - y) for (x,y) in path]
 
@@ -174,7 +436,7 @@ class KCVHXCClassifier(AbstractXCClassifier):
         height = dims[1]
         width = dims[0]
 
-        path = bestPath(startCoordinate, endCoordinate, width, height, hwcrit, wblmaxmin)
+        path = bestPath(startCoordinate, endCoordinate, width, height, hwcrit, wblmaxmin, aStar=True, margin=SEARCH_MARGIN)
 
         #plt.imshow([[hwcrit(x, y) for x in range(dims[0])] for y in range(dims[1])])
         #plt.plot([x for (x,y) in path],[y for (x,y) in path])
@@ -217,8 +479,14 @@ if __name__=='__main__':
     parser.add_argument('-a', '--xc-start-coordinate', nargs=2, type=int, default=RELEASE_RANCH, metavar='x', help='Starting coordinate for XC classification')
     parser.add_argument('-b', '--xc-end-coordinate', nargs=2, type=int, default=BLACK_MOUNTAIN, metavar='x', help='End coordinate for XC classification')
     parser.add_argument('-c', '--classifier', type=str, default='KCVH', metavar='name', help='Name of the classifier')
+    parser.add_argument('--grid-cache', type=str, metavar='path', help='Directory in which to cache decoded grids between runs')
+    parser.add_argument('--grid-cache-size', type=int, default=1024, metavar='MB', help='Size limit of the grid cache')
     args = parser.parse_args()
 
+    gridCache = None
+    if args.grid_cache:
+        gridCache = gridcache.GridFileCache(args.grid_cache, args.grid_cache_size * 2**20)
+
     positives = []
     negatives = []
     with open(args.dataset) as file:
@@ -230,7 +498,7 @@ if __name__=='__main__':
     startCoordinate = tuple(args.xc_start_coordinate)
     endCoordinate = tuple(args.xc_end_coordinate)
 
-    (features, labels) = raspdata.featuresAndLabelsFromDataset(positives, negatives, classifier)
+    (features, labels) = raspdata.featuresAndLabelsFromDataset(positives, negatives, classifier, gridCache)
 
     (fMin, fMax, fMean, fStd) = raspdata.featureStats(features)
     print('Feature min: {0}'.format(fMin))
@@ -238,13 +506,16 @@ if __name__=='__main__':
     print('Feature mean: {0}'.format(fMean))
     print('Feature std: {0}'.format(fStd))
 
-    raspdata.evaluateDataset(positives, negatives, classifier)
+    raspdata.evaluateDataset(positives, negatives, classifier, gridCache)
     print('Weight: {0}'.format(classifier.weight))
     print('Bias: {0}'.format(classifier.bias))
     print('\n\n')
 
     (classifier.weight, classifier.bias) = raspdata.learn(features, labels)
 
-    raspdata.evaluateDataset(positives, negatives, classifier)
+    raspdata.evaluateDataset(positives, negatives, classifier, gridCache)
     print('Weight: {0}'.format(classifier.weight))
     print('Bias: {0}'.format(classifier.bias))
+
+    if gridCache:
+        print('Grid cache: {0} hits, {1} misses, {2} evictions'.format(gridCache.hits, gridCache.misses, gridCache.evictions))